@@ -0,0 +1,260 @@
+"""おすすめ結果のカード HTML（表紙・タイトル・説明・Amazon リンク）の組み立て。
+
+カタログの版が同じなら、1冊のカードは (本, 表紙, 補足ラベル, レイアウト) だけで決まる。
+組み立て済みのカード（エスケープ済み）を book_card_html がこの組をキーに覚えておき、
+再実行のたびの f-string・エスケープ・リンク生成を省く。ページは覚えたカードを連結するだけ。
+"""
+from __future__ import annotations
+
+import hashlib
+import html
+import threading
+from collections import OrderedDict
+from urllib.parse import quote as urlquote
+from urllib.parse import quote_plus
+
+from lookup import AUTHOR_TOKENS
+from metrics import cache_result
+
+
+# プレースホルダー（SVG）を生成
+def build_placeholder_cover(bg: str = "#F2F4F7", fg: str = "#667085") -> str:
+    """大きなはてなマークと日本語テキストのプレースホルダー画像を返す。"""
+    svg = f'''<svg xmlns="http://www.w3.org/2000/svg" width="320" height="450" viewBox="0 0 320 450">
+<rect width="100%" height="100%" fill="{bg}"/>
+<text x="50%" y="45%" dominant-baseline="middle" text-anchor="middle" font-size="160" font-weight="700" fill="{fg}">？</text>
+<text x="50%" y="70%" dominant-baseline="middle" text-anchor="middle" font-size="24" font-weight="700" fill="{fg}">表紙画像が</text>
+<text x="50%" y="84%" dominant-baseline="middle" text-anchor="middle" font-size="24" font-weight="700" fill="{fg}">見つかりませんでした</text>
+</svg>'''
+    return "data:image/svg+xml;utf8," + urlquote(svg)
+
+
+NO_COVER_IMG = build_placeholder_cover()
+
+
+def build_loading_cover(bg: str = "#F9FAFB", fg: str = "#98A2B3") -> str:
+    """表紙を取得中の枠（同じ大きさで、取得できしだい本物の表紙に差し替える）。"""
+    svg = f'''<svg xmlns="http://www.w3.org/2000/svg" width="320" height="450" viewBox="0 0 320 450">
+<rect width="100%" height="100%" fill="{bg}"/>
+<text x="50%" y="50%" dominant-baseline="middle" text-anchor="middle" font-size="24" font-weight="700" fill="{fg}">表紙を読み込み中…</text>
+</svg>'''
+    return "data:image/svg+xml;utf8," + urlquote(svg)
+
+
+# book_card_html の cover_src にこれを渡すと「読み込み中」の枠になる
+LOADING_COVER_IMG = build_loading_cover()
+
+
+# Amazon検索リンクの生成（タイトル + 著者）
+def build_amazon_link(title: str, author: str | None = None) -> str:
+    """Amazonの検索URLを作る（直接URLは使わず検索ページに統一）。"""
+    if author and isinstance(author, str):
+        query = quote_plus(f"{title} {author}")
+    else:
+        # 著者不明なら既知の著者候補を含めて検索
+        query = quote_plus(f"{title} " + " OR ".join(AUTHOR_TOKENS))
+    return f"https://www.amazon.co.jp/s?k={query}"
+
+
+def cover_img(src: str | None) -> str:
+    """表紙の <img>。src が無ければプレースホルダー、LOADING_COVER_IMG なら読み込み中の枠。"""
+    if src == LOADING_COVER_IMG:
+        return f'<img src="{LOADING_COVER_IMG}" alt="表紙を読み込み中" />'
+    if src:
+        return f'<img src="{html.escape(src)}" alt="表紙" loading="lazy" decoding="async" referrerpolicy="no-referrer" />'
+    return f'<img src="{NO_COVER_IMG}" alt="表紙画像が見つかりませんでした" />'
+
+
+def card_html(kind: str, title: str, desc: str, link: str, cover_html: str = "", note_html: str = "") -> str:
+    """1冊ぶんのカード。kind は "hero"（最優先の1冊）か "book"（次点）。cover_html が空なら表紙枠なし。"""
+    esc_t = html.escape(str(title))
+    esc_d = html.escape(str(desc))
+    cover = f'\n    <div class="card-cover">{cover_html}</div>' if cover_html else ""
+    note = f"\n      {note_html}" if note_html else "\n"
+    return f"""<div class="{kind}-card">
+  <div class="card-grid">{cover}
+    <div class="card-body">
+      <div class="{kind}-title">『{esc_t}』</div>{note}
+      <p class="{kind}-desc">{esc_d}</p>
+      <a class="link-btn" href="{link}" target="_blank" rel="noopener" aria-label="Amazonで{esc_t}を検索">📦 Amazonで見る</a>
+    </div>
+  </div>
+</div>
+"""
+
+
+def note_html(note: str) -> str:
+    """補完で選んだ本に添える補足ラベル（空なら何も付けない）。"""
+    return f"<div class='sub-label'>{html.escape(note)}</div>" if note else ""
+
+
+# 覚えておくカードの数（表示する3冊 × 表紙・ラベル・レイアウトの組み合わせ。カタログ全体でも数百）
+CARD_CACHE_SIZE: int = 512
+
+
+def cover_key(src: str | None) -> str:
+    """表紙 src の短い要約（data URI は数十KBあるのでキーにはハッシュを使う）。"""
+    if not src:
+        return ""
+    return hashlib.blake2b(src.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class CardFragments:
+    """組み立て済みカード HTML の LRU キャッシュ。スレッドセーフ（セッション間で共有）。"""
+
+    def __init__(self, maxsize: int = CARD_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items: OrderedDict[tuple[str, str, str, str], str] = OrderedDict()
+
+    def get(self, key: tuple[str, str, str, str]) -> str | None:
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is not None:
+                self._items.move_to_end(key)
+            return hit
+
+    def put(self, key: tuple[str, str, str, str], fragment: str) -> None:
+        with self._lock:
+            self._items[key] = fragment
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+_fragments = CardFragments()
+
+
+def get_card_fragments() -> CardFragments:
+    return _fragments
+
+
+def _compact(fragment: str) -> str:
+    """ページに直接埋めるための1行ずつ詰めた HTML。
+
+    st.markdown は空行で HTML ブロックを終わらせ、字下げした行をコードブロックとして扱うので、
+    空行と行頭の空白を落とす（説明文中の改行も HTML では空白と同じ）。
+    """
+    return "\n".join(line.strip() for line in fragment.splitlines() if line.strip())
+
+
+def book_card_html(kind: str, book_id: str | None, title: str, desc: str, author: str | None,
+                   cover_src: str | None, note: str = "", show_cover: bool = True, layout: str = "iframe") -> str:
+    """1冊ぶんのカード（card_html と同じもの）を、覚えていればそのまま返す。
+
+    book_id は行の内容から決まる ID（catalogue.row_hashes の値）。行が書き換われば ID も変わるので、
+    古いカードが出ることはない。None なら覚えずに毎回組み立てる。
+    layout は "iframe"（components.html の文書に入れる）か "native"（ページに直接描く。_compact 済み）。
+    """
+    key = (book_id or "", cover_key(cover_src) if show_cover else "-", note, f"{kind}/{layout}")
+    if book_id:
+        hit = _fragments.get(key)
+        cache_result("card_fragment", hit=hit is not None)
+        if hit is not None:
+            return hit
+    fragment = card_html(kind, title, desc, build_amazon_link(title, author),
+                         cover_img(cover_src) if show_cover else "", note_html(note))
+    if layout == "native":
+        fragment = _compact(fragment)
+    if book_id:
+        _fragments.put(key, fragment)
+    return fragment
+
+
+# components.html 用の文書の前後（CSS・スクリプト）。中身に依存しないので、毎回組み立てずに連結するだけにする
+_HERO_PAGE_HEAD = """
+<style>
+body{margin:0;font-family:'Hiragino Sans','Noto Sans JP','Yu Gothic',sans-serif;color:#374151;}
+.hero-card,.book-card{background:#fff;border:1px solid #E6E6E6;border-radius:10px;padding:16px 18px;box-shadow:0 2px 6px rgba(0,0,0,.05);}
+.card-grid{display:grid;grid-template-columns:170px 1fr;gap:12px;align-items:start}
+.card-cover img{width:100%;height:auto;max-height:200px;object-fit:contain;background:#fafafa;border:1px solid #eee;border-radius:8px;padding:8px;box-sizing:border-box}
+.hero-title{font-weight:700;margin-bottom:6px;font-size:18px;line-height:1.5}
+.hero-desc{margin:8px 0 12px;line-height:1.7;font-size:16px;color:#374151}
+.link-btn{display:inline-block;padding:8px 18px;border-radius:6px;text-decoration:none;background:#EEF2FF;color:#1D4ED8;border:1px solid #c7d2fe;font-weight:600;}
+.card-body{display:flex;flex-direction:column;gap:8px;justify-content:space-between}
+.card-body .link-btn{align-self:flex-end}
+@media (max-width:640px){
+  .card-grid{grid-template-columns:1fr; gap:12px;}
+  .card-cover img{max-height:260px; margin:0 auto;}
+  .hero-title{text-align:center;}
+  .hero-desc{font-size:15px; line-height:1.7;}
+  .card-body .link-btn{align-self:stretch; text-align:center; width:100%;}
+}
+</style>
+"""
+_HERO_PAGE_TAIL = """
+<script>
+  // Auto-resize the components.html iframe to fit content height (desktop fixes big gap)
+  (function(){
+    function resize(){
+      try{
+        var fe = window.frameElement;
+        if(!fe) return;
+        // Measure full document height
+        var h = Math.max(document.body.scrollHeight, document.documentElement.scrollHeight);
+        fe.style.height = Math.ceil(h) + 'px';
+      }catch(e){}
+    }
+    window.addEventListener('load', resize);
+    window.addEventListener('resize', function(){ setTimeout(resize, 50); });
+    setTimeout(resize, 100);
+  })();
+</script>
+"""
+_GRID_PAGE_HEAD = """
+<style>
+body{margin:0;font-family:'Hiragino Sans','Noto Sans JP','Yu Gothic',sans-serif;color:#374151;}
+.book-grid{display:grid;gap:16px;}
+@media (min-width:768px){ .book-grid{grid-template-columns:1fr 1fr;} }
+.book-card{background:#fff;border:1px solid #E6E6E6;border-radius:10px;padding:16px 18px;box-shadow:0 2px 6px rgba(0,0,0,.05);}
+.card-grid{display:grid;grid-template-columns:140px 1fr;gap:10px;align-items:start}
+.card-cover img{width:100%;height:auto;max-height:200px;object-fit:contain;background:#fafafa;border:1px solid #eee;border-radius:8px;padding:8px;box-sizing:border-box}
+.book-title{font-weight:700;margin-bottom:6px;font-size:17px;line-height:1.5}
+.book-desc{margin:8px 0 12px;line-height:1.7;font-size:15px;color:#374151}
+.link-btn{display:inline-block;padding:8px 18px;border-radius:6px;text-decoration:none;background:#EEF2FF;color:#1D4ED8;border:1px solid #c7d2fe;font-weight:600;}
+.sub-label{ font-size: 14px; color:#6b7280; margin:4px 0 6px; font-style: italic; }
+.card-body{display:flex;flex-direction:column;gap:8px;justify-content:space-between}
+.card-body .link-btn{align-self:flex-end}
+@media (max-width:640px){
+  .card-grid{grid-template-columns:1fr; gap:12px;}
+  .card-cover img{max-height:220px; margin:0 auto;}
+  .book-title{text-align:center;}
+  .book-desc{font-size:14px; line-height:1.7;}
+  .card-body .link-btn{align-self:stretch; text-align:center; width:100%;}
+}
+</style>
+<div class='book-grid'>"""
+_GRID_PAGE_TAIL = """</div>
+"""
+
+
+def hero_page_html(hero_html: str) -> str:
+    """最優先の1冊を描く components.html 用の文書（高さを中身に合わせるスクリプトつき）。"""
+    return _HERO_PAGE_HEAD + hero_html + _HERO_PAGE_TAIL
+
+
+def grid_page_html(cards_html: list[str]) -> str:
+    """次点のカードを横並び（スマホは縦）にする components.html 用の文書。"""
+    return _GRID_PAGE_HEAD + "".join(cards_html) + _GRID_PAGE_TAIL
+
+
+def results_html(hero_heading: str, hero_html: str, others_heading: str, cards_html: list[str]) -> str:
+    """最優先の1冊と次点のカードを、1つの st.markdown で描くブロックにまとめる。
+
+    スタイルはページ冒頭の CSS（.hero-card / .book-grid など）を共有するので、ここには含めない。
+    カードは layout="native" で組み立てたもの（空行・字下げなし）を渡すこと。
+    """
+    cards = "\n".join(cards_html)
+    return (
+        f"<div class='section section-hero'>\n<h2>{html.escape(hero_heading)}</h2>\n<div class='divider'></div>\n"
+        f"{hero_html}\n</div>\n"
+        f"<div class='section section-others'>\n<h2>{html.escape(others_heading)}</h2>\n<div class='divider'></div>\n"
+        f"<div class='book-grid'>\n{cards}\n</div>\n</div>"
+    )
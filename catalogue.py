@@ -0,0 +1,371 @@
+"""書籍カタログ（公開スプレッドシート）の読み込みと、事前解決マニフェストの結合。"""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, NamedTuple
+
+import pandas as pd
+
+from http_client import http_get
+from metrics import cache_result, span
+
+# tools/enrich_catalogue.py が書き出す「タイトル → ISBN / 表紙」の対応表
+ENRICHMENT_MANIFEST_PATH: str = os.environ.get(
+    "ENRICHMENT_MANIFEST_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "enrichment_manifest.json"),
+)
+# マニフェストから books に足す列（cover_digest は get_cover_url が画像をストアから直接配るのに使う）
+MANIFEST_COLUMNS = ["cover_digest"]
+
+
+def load_manifest(path: str | None = None) -> dict[str, dict]:
+    """マニフェストを読み込んで {title: entry} を返す。無い・壊れている場合は空。"""
+    try:
+        with open(path or ENRICHMENT_MANIFEST_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        return dict(data.get("entries") or {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(entries: dict[str, dict], path: str | None = None) -> None:
+    """マニフェストを書き出す（一時ファイル経由で置き換えるので途中で壊れない）。"""
+    path = path or ENRICHMENT_MANIFEST_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "entries": entries}, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def apply_manifest(df: pd.DataFrame, entries: dict[str, dict]) -> pd.DataFrame:
+    """シートの ISBN が空の行にマニフェストの ISBN を補い、事前解決した表紙の列（cover_digest）を足す。"""
+    df = df.copy()
+    for col in MANIFEST_COLUMNS:
+        df[col] = ""
+    if not entries or df.empty:
+        return df
+    got = df["title"].map(lambda t: entries.get(t) or {})
+    missing_isbn = df["isbn"] == ""
+    df.loc[missing_isbn, "isbn"] = got[missing_isbn].map(lambda e: e.get("isbn") or "")
+    for col in MANIFEST_COLUMNS:
+        df[col] = got.map(lambda e, c=col: e.get(c) or "")
+    return df
+
+
+def manifest_stamp(path: str | None = None) -> int:
+    """マニフェストの更新時刻（ns。無ければ 0）。シートが変わっていなくても結合し直すかの判断に使う。"""
+    try:
+        return os.stat(path or ENRICHMENT_MANIFEST_PATH).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def catalogue_version(df: pd.DataFrame) -> str:
+    """カタログの内容から決まる版（内容が同じなら同じ値）。前計算テーブルのキーに使う。"""
+    h = hashlib.sha1(",".join(map(str, df.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()[:16]
+
+
+SHEET_URL = "https://docs.google.com/spreadsheets/d/e/2PACX-1vRrOkycGi4nVcR_f2HES6pkm4Yz8BiwFr2L9t3Zf0_j0c_eRy0g2pM9cxZj6fRfsUM20urikULvOqub/pub?output=csv"
+# 行の同一性を見る列と、行の内容として比べる列
+ROW_KEY = "title"
+ROW_COLUMNS = ["title", "description", "amazon_url", "keywords", "isbn"]
+
+
+def parse_sheet(text: str) -> pd.DataFrame:
+    """公開CSVの本文を books の形（列名の正規化・欠損列の補完・空白除去・タイトル重複除去）にする。
+
+    タイトル列が見つからなければ ValueError。
+    """
+    # 全列を文字列として読む（ISBN が浮動小数になったり、空欄が "nan" になったりしないように）
+    df = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False)
+    # 標準化
+    df.columns = df.columns.str.strip().str.replace('"', "").str.replace("\n", "", regex=False)
+    # 期待カラム名への寄せ
+    rename_map: dict[str, str] = {}
+    for c in df.columns:
+        lc = c.lower()
+        if "title" in lc and " " not in lc:
+            rename_map[c] = "title"
+        if "amazon" in lc:
+            rename_map[c] = "amazon_url"
+        if "keyword" in lc:
+            rename_map[c] = "keywords"
+        if "description" in lc:
+            rename_map[c] = "description"
+    df = df.rename(columns=rename_map)
+    # タイトル列が無いのはシートではない（200 で返ってきたエラーページなど）
+    if "title" not in df.columns:
+        raise ValueError("シートにタイトル列がありません")
+    # 欠損カラムの安全対策
+    for col in ROW_COLUMNS:
+        if col not in df.columns:
+            df[col] = ""
+    # 前後空白の除去
+    # ISBN 列も文字列化してからトリムする（数値として読み込まれることがあるため）
+    for col in ROW_COLUMNS:
+        df[col] = df[col].astype(str).str.strip()
+    # 重複排除（タイトルで一意に）
+    df = df.drop_duplicates(subset=["title"]).reset_index(drop=True)
+    return df
+
+
+def row_hashes(df: pd.DataFrame) -> dict[str, str]:
+    """{タイトル: 行内容のハッシュ}。行単位の差分検出に使う。"""
+    out: dict[str, str] = {}
+    for values in zip(*(df[c].astype(str) for c in ROW_COLUMNS)):
+        out[values[0]] = hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()[:16]
+    return out
+
+
+@dataclass
+class CatalogueDiff:
+    """前回のシートからの行単位の差分（タイトルで対応づけ）。"""
+    base: str  # 差分の基準になった前回シートの版
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    @property
+    def touched(self) -> set[str]:
+        """追加・変更された行（下流で作り直しが必要な行）。"""
+        return set(self.added) | set(self.changed)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+def diff_rows(base: str, old: dict[str, str], new: dict[str, str]) -> CatalogueDiff:
+    return CatalogueDiff(
+        base=base,
+        added=[t for t in new if t not in old],
+        changed=[t for t, h in new.items() if t in old and old[t] != h],
+        removed=[t for t in old if t not in new],
+    )
+
+
+class _SheetState:
+    """前回取得したシートの状態（条件付きGETの検証子・本文ハッシュ・パース結果）。プロセス内で共有。"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.etag = ""
+        self.last_modified = ""
+        self.body_hash = ""
+        self.sheet: pd.DataFrame | None = None
+        self.hashes: dict[str, str] = {}
+
+
+_sheet_state = _SheetState()
+
+
+class SheetRefresh(NamedTuple):
+    sheet: pd.DataFrame | None  # パース済みシート（取得に失敗したら None）
+    diff: CatalogueDiff | None  # 今回の取り直しで見つかった行差分（変わっていない・初回は None）
+    changed: bool  # 前回から本文が変わったか（初回は True）
+
+
+def refresh_sheet(state: _SheetState | None = None) -> SheetRefresh:
+    """シートを条件付きで取り直す。
+
+    ETag / Last-Modified があれば If-None-Match / If-Modified-Since を送り、304 なら前回のシートを
+    changed=False で返す。200 でも本文のハッシュが前回と同じならパースを省いて同じく changed=False。
+    取得・パースに失敗したら sheet=None（手元の状態は変えない）。検証子は本文のパースに成功したときだけ
+    本文ハッシュと一緒に覚える（壊れた応答の検証子で 304 を受け続けないように）。
+    """
+    state = state or _sheet_state
+    headers = {"User-Agent": "Mozilla/5.0 (compatible; matsuda-book-app-v1/1.0)"}
+    with state.lock:
+        if state.sheet is not None:
+            if state.etag:
+                headers["If-None-Match"] = state.etag
+            if state.last_modified:
+                headers["If-Modified-Since"] = state.last_modified
+        # 再試行（バックオフつき）は共有クライアント側の方針に任せる
+        try:
+            resp = http_get(SHEET_URL, headers=headers, timeout=(3.05, 10))
+            if resp.status_code == 304 and state.sheet is not None:
+                cache_result("sheet", hit=True)
+                return SheetRefresh(state.sheet, None, False)
+            resp.raise_for_status()
+        except Exception:
+            return SheetRefresh(None, None, False)
+        etag, last_modified = resp.headers.get("ETag", ""), resp.headers.get("Last-Modified", "")
+        body_hash = hashlib.sha256(resp.content).hexdigest()
+        if body_hash == state.body_hash and state.sheet is not None:
+            # パース済みの本文と同じなので、この応答の検証子を覚えてよい
+            state.etag, state.last_modified = etag, last_modified
+            cache_result("sheet", hit=True)
+            return SheetRefresh(state.sheet, None, False)
+        cache_result("sheet", hit=False)
+        try:
+            text = resp.content.decode("utf-8-sig", errors="replace")
+        except Exception:
+            text = resp.content.decode("cp932", errors="replace")
+        try:
+            sheet = parse_sheet(text)
+        except Exception:
+            return SheetRefresh(None, None, False)
+        hashes = row_hashes(sheet)
+        version = body_hash[:16]
+        sheet.attrs["sheet_version"] = version
+        diff = None
+        if state.sheet is not None:
+            diff = diff_rows(state.sheet.attrs.get("sheet_version", ""), state.hashes, hashes)
+        state.etag, state.last_modified = etag, last_modified
+        state.body_hash, state.sheet, state.hashes = body_hash, sheet, hashes
+        return SheetRefresh(sheet, diff, True)
+
+
+def build_books(current: pd.DataFrame | None = None) -> pd.DataFrame | None:
+    """シートを（条件付きで）取り直し、マニフェストを結合した books を作る。取れなければ None。
+
+    シートもマニフェストも current を作ったときから変わっていなければ、current をそのまま返す
+    （呼び出し側は「同じオブジェクトなら公開し直さない」で判断できる）。
+    attrs には version（マニフェスト込みの内容の版）、sheet_version（シート本文の版）、
+    row_hashes、diff（今回の取り直しでの行差分。初回・マニフェストだけの更新では無し）、
+    manifest_stamp が入る。下流の索引はこれを見て差分だけ作り直す。
+    """
+    with span("load_books") as s:
+        refresh = refresh_sheet()
+        sheet = refresh.sheet
+        if sheet is None:
+            s["outcome"] = "unavailable"
+            return None
+        stamp = manifest_stamp()
+        if (
+            current is not None and not refresh.changed
+            and current.attrs.get("sheet_version") == sheet.attrs.get("sheet_version")
+            and current.attrs.get("manifest_stamp") == stamp
+        ):
+            s["outcome"] = "unchanged"
+            return current
+        # 事前解決済みの ISBN / 表紙情報を結合（tools/enrich_catalogue.py が生成）
+        df = apply_manifest(sheet, load_manifest())
+        df.attrs["sheet_version"] = sheet.attrs.get("sheet_version", "")
+        df.attrs["row_hashes"] = row_hashes(sheet)
+        if refresh.diff is not None:
+            df.attrs["diff"] = refresh.diff
+        df.attrs["manifest_stamp"] = stamp
+        df.attrs["version"] = catalogue_version(df)
+        s["outcome"] = "ok"
+        return df
+
+
+# スナップショットの鮮度（これを過ぎたら裏で取り直す）と、取得に失敗したときの再試行間隔
+CATALOGUE_MAX_AGE: int = 60 * 10
+CATALOGUE_RETRY: int = 30
+
+
+class CatalogueHolder:
+    """books の最新スナップショットを持ち、古くなったら裏のスレッドで取り直す（stale-while-revalidate）。
+
+    get() は決して待たない。手元にある最後の正常なスナップショットを返し、
+    必要なら背景の再取得を1本だけ起動する。取り直しが終わったら参照を差し替えるだけなので、
+    読み手が途中の状態を見ることはない。取り直しに失敗したら前のスナップショットを使い続ける。
+    builder(current) がシートに変わりが無いとして current をそのまま返したら、公開し直さない。
+    """
+
+    def __init__(self, builder=build_books, max_age: float = CATALOGUE_MAX_AGE, retry: float = CATALOGUE_RETRY):
+        self._builder = builder
+        self.max_age = max_age
+        self.retry = retry
+        self._snapshot: pd.DataFrame | None = None
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._refreshing = False
+        self.attempts = 0
+        self.last_error: str | None = None
+        self._listeners: list[Callable[[pd.DataFrame], None]] = []
+
+    def get(self) -> pd.DataFrame | None:
+        """今あるスナップショット（初回読み込み前なら None）を返し、古ければ裏で取り直す。"""
+        with self._lock:
+            snapshot = self._snapshot
+            if time.monotonic() >= self._next_refresh and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, name="catalogue-refresh", daemon=True).start()
+        return snapshot
+
+    def wait(self, timeout: float | None = None) -> pd.DataFrame | None:
+        """スナップショットが1つもなければ、初回の読み込みが終わるまで（最大 timeout 秒）待つ。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.get()
+        with self._lock:
+            while self._snapshot is None and (self._refreshing or self.attempts == 0):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._done.wait(remaining)
+            snapshot = self._snapshot
+        return snapshot
+
+    def on_publish(self, fn: Callable[[pd.DataFrame], None]) -> None:
+        """新しいスナップショットを公開した直後に（取り直しのスレッドで）fn(df) を呼ぶ。同じ fn は1回だけ登録される。"""
+        with self._lock:
+            if fn not in self._listeners:
+                self._listeners.append(fn)
+
+    @property
+    def loading(self) -> bool:
+        with self._lock:
+            return self._refreshing
+
+    def _refresh(self) -> None:
+        with self._lock:
+            current = self._snapshot
+        try:
+            df = self._builder(current)
+            error = None if df is not None else "シートを取得できませんでした"
+        except Exception as e:  # 背景スレッドで落ちても前のスナップショットで動き続ける
+            df, error = None, repr(e)
+        with self._lock:
+            self.attempts += 1
+            self.last_error = error
+            # 変わっていなければ（builder が current をそのまま返したら）公開し直さない
+            published = df is not None and df is not current
+            if published:
+                self._snapshot = df
+            self._next_refresh = time.monotonic() + (self.max_age if df is not None else self.retry)
+            self._refreshing = False
+            self._done.notify_all()
+            listeners = list(self._listeners) if published else []
+        # 読み手には公開済み。ここでの前計算は待たせない
+        for fn in listeners:
+            try:
+                fn(df)
+            except Exception:
+                pass
+
+
+_holder: CatalogueHolder | None = None
+_holder_lock = threading.Lock()
+
+
+def get_catalogue_holder() -> CatalogueHolder:
+    """プロセス共有のカタログホルダーを返す。"""
+    global _holder
+    if _holder is None:
+        with _holder_lock:
+            if _holder is None:
+                _holder = CatalogueHolder()
+    return _holder
+
+
+def empty_books() -> pd.DataFrame:
+    return pd.DataFrame(columns=["title", "description", "amazon_url", "keywords", "isbn"])  # safe empty
+
+
+def load_books(timeout: float | None = 30) -> pd.DataFrame:
+    """books を同期的に返す（バッチ処理用）。初回は読み込みを待ち、取れなければ空の DataFrame。"""
+    df = get_catalogue_holder().wait(timeout)
+    return df if df is not None else empty_books()
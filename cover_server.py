@@ -0,0 +1,113 @@
+"""表紙画像をキャッシュ可能な URL で配る小さな画像サーバー。
+
+data URI で埋め込むとページを開くたびに同じ画像を送り直すことになり、ブラウザも
+キャッシュできない。ここでは cover_store の画像を内容ハッシュ入りの URL
+（/covers/<digest>.<variant>）で配り、長期の Cache-Control: immutable を付ける。
+URL が内容で決まるので、画像が変われば URL も変わり、古いキャッシュが残る心配はない。
+
+Streamlit 本体とは別ポートで動くので、外部公開時はリバースプロキシで
+/covers/ をこのポートへ流し、COVER_ROUTE_BASE に公開側のURLを設定する。
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cover_store import get_cover_store
+
+COVER_ROUTE_HOST: str = os.environ.get("COVER_ROUTE_HOST", "127.0.0.1")
+COVER_ROUTE_PORT: int = int(os.environ.get("COVER_ROUTE_PORT", "8599"))
+# ブラウザから見た /covers のURL（末尾スラッシュなし）
+COVER_ROUTE_BASE: str = os.environ.get("COVER_ROUTE_BASE", f"http://localhost:{COVER_ROUTE_PORT}/covers").rstrip("/")
+# 内容ハッシュ入りの URL なので1年・immutable で構わない
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# "orig" は元画像、それ以外は cover_store の派生画像名（例: thumb-340x400.webp）
+_PATH_RE = re.compile(r"^/covers/([0-9a-f]{64})\.([A-Za-z0-9_.\-]+)$")
+
+_server: ThreadingHTTPServer | None = None
+_started = False
+_lock = threading.Lock()
+
+
+def cover_route_url(digest: str, variant: str = "orig") -> str:
+    return f"{COVER_ROUTE_BASE}/{digest}.{variant}"
+
+
+class _CoverHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "matsuda-book-covers/1.0"
+
+    def _lookup(self) -> tuple[bytes, str, str] | None:
+        m = _PATH_RE.match(self.path.split("?", 1)[0])
+        if not m:
+            return None
+        digest, variant = m.groups()
+        store = get_cover_store()
+        got = store.get_blob(digest) if variant == "orig" else store.get_variant(digest, variant)
+        if got is None:
+            return None
+        data, ctype = got
+        return data, ctype, f'"{digest}.{variant}"'
+
+    def _respond(self, with_body: bool) -> None:
+        try:
+            found = self._lookup()
+        except Exception:
+            found = None
+        if found is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            return
+        data, ctype, etag = found
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        self.send_header("ETag", etag)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("X-Content-Type-Options", "nosniff")
+        self.end_headers()
+        if with_body:
+            self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        self._respond(with_body=True)
+
+    def do_HEAD(self) -> None:
+        self._respond(with_body=False)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def ensure_cover_server() -> None:
+    """画像サーバーをプロセスに1つだけ起動する。
+
+    ポートが既に使われている場合は、同じストアを読む別プロセス（別ワーカー）の
+    サーバーが配っているとみなして何もしない。
+    """
+    global _server, _started
+    if _started:
+        return
+    with _lock:
+        if _started:
+            return
+        _started = True
+        try:
+            srv = ThreadingHTTPServer((COVER_ROUTE_HOST, COVER_ROUTE_PORT), _CoverHandler)
+        except OSError:
+            return
+        srv.daemon_threads = True
+        threading.Thread(target=srv.serve_forever, name="cover-server", daemon=True).start()
+        _server = srv
@@ -0,0 +1,369 @@
+"""表紙画像のローカル永続ストア（SQLite）。
+
+画像のバイト列は内容のハッシュ（sha256）をキーに一度だけ保存し、
+ISBN や正規化タイトルといった「引き当てキー」からそのハッシュを参照する。
+版違いで同じ画像が返ってきても実体は1つにまとまる。
+
+プロセスの再起動やデプロイをまたいで残るので、OpenBD / Google Books への
+問い合わせは TTL 切れの再検証か、まだ一度も取れていない本だけになる。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+
+# 保存先（環境変数で差し替え可）
+COVER_STORE_PATH: str = os.environ.get(
+    "COVER_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "covers.sqlite3")
+)
+# この期間内のエントリはネットワークに問い合わせずにそのまま使う
+COVER_TTL: int = 30 * 24 * 60 * 60
+# 見つからなかった ISBN / 表紙を再確認するまでの間隔。外れるたびに倍にし、上限で頭打ち
+MISS_RETRY_BASE: int = 60 * 60
+MISS_RETRY_MAX: int = 30 * 24 * 60 * 60
+# 上流のエラー・時間切れでの失敗は、外れとは数えず短い間隔で確認し直す
+MISS_RETRY_TRANSIENT: int = 10 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest       TEXT PRIMARY KEY,
+    content_type TEXT NOT NULL,
+    data         BLOB NOT NULL,
+    size         INTEGER NOT NULL,
+    created_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cover_keys (
+    key           TEXT PRIMARY KEY,
+    digest        TEXT NOT NULL REFERENCES blobs(digest),
+    source        TEXT NOT NULL DEFAULT '',
+    url           TEXT NOT NULL DEFAULT '',
+    etag          TEXT NOT NULL DEFAULT '',
+    last_modified TEXT NOT NULL DEFAULT '',
+    fetched_at    REAL NOT NULL,
+    checked_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cover_keys_digest ON cover_keys(digest);
+CREATE TABLE IF NOT EXISTS variants (
+    digest       TEXT NOT NULL REFERENCES blobs(digest),
+    variant      TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    data         BLOB NOT NULL,
+    size         INTEGER NOT NULL,
+    created_at   REAL NOT NULL,
+    PRIMARY KEY (digest, variant)
+);
+CREATE TABLE IF NOT EXISTS misses (
+    key        TEXT PRIMARY KEY,
+    attempts   INTEGER NOT NULL,
+    failures   TEXT NOT NULL DEFAULT '{}',
+    first_at   REAL NOT NULL,
+    checked_at REAL NOT NULL,
+    retry_at   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS openbd (
+    isbn       TEXT PRIMARY KEY,
+    cover_url  TEXT NOT NULL DEFAULT '',
+    checked_at REAL NOT NULL
+);
+"""
+
+
+def normalize_title(title: str) -> str:
+    """タイトルを引き当て用に正規化する（NFKC・小文字化・空白/記号除去、かなと漢字は残す）。"""
+    s = unicodedata.normalize("NFKC", title or "").lower()
+    s = re.sub(r"[\s・:：、。,.!！?？『』「」（）()\[\]【】〈〉《》—–‐\-／/]", "", s)
+    return s
+
+
+def isbn_key(isbn: str | None) -> str | None:
+    digits = re.sub(r"[^0-9Xx]", "", isbn or "")
+    return f"isbn:{digits}" if digits else None
+
+
+def title_key(title: str | None) -> str | None:
+    t = normalize_title(title or "")
+    return f"title:{t}" if t else None
+
+
+@dataclass
+class StoredCover:
+    key: str
+    digest: str
+    content_type: str
+    data: bytes
+    source: str
+    url: str
+    etag: str
+    last_modified: str
+    fetched_at: float
+    checked_at: float
+    fresh: bool
+
+
+@dataclass
+class KnownMiss:
+    """引いても見つからなかった記録。failures は {情報源: 理由}（例: {"ndl": "no_match"}）。"""
+    key: str
+    attempts: int
+    failures: dict[str, str]
+    first_at: float
+    checked_at: float
+    retry_at: float
+
+    @property
+    def due(self) -> bool:
+        """再確認の時期が来ているか。"""
+        return time.time() >= self.retry_at
+
+
+class CoverStore:
+    """ISBN / タイトル → 画像ハッシュ → バイト列 の2段構成のストア。スレッドセーフ。"""
+
+    def __init__(self, path: str = COVER_STORE_PATH, ttl: int = COVER_TTL):
+        self.path = path
+        self.ttl = ttl
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def get(self, key: str | None) -> StoredCover | None:
+        if not key:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT k.key, k.digest, b.content_type, b.data, k.source, k.url,
+                       k.etag, k.last_modified, k.fetched_at, k.checked_at
+                FROM cover_keys k JOIN blobs b ON b.digest = k.digest
+                WHERE k.key = ?
+                """,
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        fresh = (time.time() - row[9]) < self.ttl
+        return StoredCover(*row, fresh=fresh)
+
+    def put(
+        self,
+        keys: list[str | None],
+        data: bytes,
+        content_type: str,
+        source: str = "",
+        url: str = "",
+        etag: str = "",
+        last_modified: str = "",
+    ) -> str:
+        """画像を保存し、与えられたすべてのキーをその画像に向ける。ハッシュを返す。"""
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs(digest, content_type, data, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (digest, content_type, sqlite3.Binary(data), len(data), now),
+            )
+            for key in dict.fromkeys(k for k in keys if k):
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO cover_keys
+                        (key, digest, source, url, etag, last_modified, fetched_at, checked_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, digest, source, url, etag or "", last_modified or "", now, now),
+                )
+            self._conn.commit()
+        return digest
+
+    def link(self, keys: list[str | None], digest: str) -> None:
+        """既存の画像に別のキー（例: 後から分かった ISBN）を追加で向ける。"""
+        with self._lock:
+            src = self._conn.execute(
+                "SELECT source, url, etag, last_modified, fetched_at, checked_at FROM cover_keys WHERE digest = ? LIMIT 1",
+                (digest,),
+            ).fetchone()
+            if src is None:
+                return
+            for key in dict.fromkeys(k for k in keys if k):
+                self._conn.execute(
+                    """
+                    INSERT OR IGNORE INTO cover_keys
+                        (key, digest, source, url, etag, last_modified, fetched_at, checked_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, digest, *src),
+                )
+            self._conn.commit()
+
+    def touch(self, key: str) -> None:
+        """再検証で「変わっていない」と分かったエントリの鮮度を更新する。"""
+        with self._lock:
+            self._conn.execute("UPDATE cover_keys SET checked_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cover_keys WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def get_blob(self, digest: str) -> tuple[bytes, str] | None:
+        """元画像を (bytes, content_type) で返す。"""
+        with self._lock:
+            row = self._conn.execute("SELECT data, content_type FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def get_variant(self, digest: str, variant: str) -> tuple[bytes, str] | None:
+        """縮小版などの派生画像を (bytes, content_type) で返す。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, content_type FROM variants WHERE digest = ? AND variant = ?", (digest, variant)
+            ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def put_variant(self, digest: str, variant: str, data: bytes, content_type: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO variants(digest, variant, content_type, data, size, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (digest, variant, content_type, sqlite3.Binary(data), len(data), time.time()),
+            )
+            self._conn.commit()
+
+    def get_miss(self, key: str | None) -> KnownMiss | None:
+        if not key:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, attempts, failures, first_at, checked_at, retry_at FROM misses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return KnownMiss(row[0], row[1], json.loads(row[2] or "{}"), *row[3:])
+
+    def record_miss(self, key: str | None, failures: dict[str, str], transient: bool = False) -> KnownMiss | None:
+        """見つからなかったことを記録し、次の再確認時刻を決める。
+
+        外れるたびに間隔を MISS_RETRY_BASE から倍々に延ばす（MISS_RETRY_MAX まで）。
+        transient（上流のエラー・時間切れ）なら回数は増やさず、短い間隔で確認し直す。
+        """
+        if not key:
+            return None
+        now = time.time()
+        prev = self.get_miss(key)
+        attempts = (prev.attempts if prev else 0) + (0 if transient else 1)
+        if transient:
+            wait = MISS_RETRY_TRANSIENT
+        else:
+            wait = min(MISS_RETRY_MAX, MISS_RETRY_BASE * 2 ** (attempts - 1))
+        miss = KnownMiss(key, attempts, dict(failures), prev.first_at if prev else now, now, now + wait)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO misses(key, attempts, failures, first_at, checked_at, retry_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (key, miss.attempts, json.dumps(miss.failures, ensure_ascii=False), miss.first_at, now, miss.retry_at),
+            )
+            self._conn.commit()
+        return miss
+
+    def clear_miss(self, key: str | None) -> None:
+        if not key:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM misses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear_misses(self) -> int:
+        """「見つからなかった」記録をすべて消す（全件を確認し直すとき用）。消した件数を返す。"""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM misses")
+            self._conn.commit()
+            return cur.rowcount
+
+    def get_openbd(self, isbns: list[str]) -> dict[str, tuple[str, float]]:
+        """OpenBD の書誌から分かった表紙URL（無ければ ""）と確認時刻を ISBN ごとに返す。"""
+        out: dict[str, tuple[str, float]] = {}
+        isbns = list(dict.fromkeys(i for i in isbns if i))
+        with self._lock:
+            for i in range(0, len(isbns), 500):
+                chunk = isbns[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT isbn, cover_url, checked_at FROM openbd WHERE isbn IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                out.update({isbn: (url, checked_at) for isbn, url, checked_at in rows})
+        return out
+
+    def put_openbd(self, covers: dict[str, str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO openbd(isbn, cover_url, checked_at) VALUES (?, ?, ?)",
+                [(isbn, url or "", now) for isbn, url in covers.items()],
+            )
+            self._conn.commit()
+
+    def prune(self) -> int:
+        """どのキーからも参照されなくなった画像（と派生画像）を削除し、削除件数を返す。"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM variants WHERE digest NOT IN (SELECT DISTINCT digest FROM cover_keys)"
+            )
+            cur = self._conn.execute(
+                "DELETE FROM blobs WHERE digest NOT IN (SELECT DISTINCT digest FROM cover_keys)"
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            n_keys = self._conn.execute("SELECT COUNT(*) FROM cover_keys").fetchone()[0]
+            n_blobs, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            n_miss = self._conn.execute("SELECT COUNT(*) FROM misses").fetchone()[0]
+            n_var, var_bytes, orig_bytes = self._conn.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(v.size), 0), COALESCE(SUM(b.size), 0)
+                FROM variants v JOIN blobs b ON b.digest = v.digest
+                """
+            ).fetchone()
+        # variant_saved_bytes: 派生画像を元画像の代わりに配ることで1回あたりに減るバイト数の合計
+        return {
+            "keys": n_keys, "blobs": n_blobs, "bytes": total,
+            "variants": n_var, "variant_bytes": var_bytes, "variant_saved_bytes": orig_bytes - var_bytes,
+            "misses": n_miss,
+        }
+
+
+_store: CoverStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_cover_store() -> CoverStore:
+    """プロセス共有のストアを返す（初回呼び出し時に開く）。"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CoverStore()
+    return _store
+
+
+def set_cover_store(store: CoverStore) -> None:
+    """プロセス共有のストアを差し替える（ベンチマークで空のストアから測り直すときなど）。"""
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,137 @@
+"""上流 API 向けの共有 HTTP クライアント。
+
+ホストごとに1つ、コネクションプール付きの requests.Session を持ち、
+Keep-Alive で TCP / TLS ハンドシェイクを使い回す。タイムアウトとリトライの方針も
+ここで一律に決め、シート・NDL・Google Books・OpenBD への呼び出しはすべてここを通す。
+
+UPSTREAM_BASE_URL を設定すると、すべての上流 URL を https://host/path → {base}/host/path に
+書き換える（tools/stub_server.py などの手元の代役に向けて、遅い・落ちる上流を再現するとき用）。
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import record_upstream
+
+USER_AGENT = "Mozilla/5.0 (compatible; matsuda-book-app/2.0)"
+# (接続, 読み取り) 秒
+DEFAULT_TIMEOUT: tuple[float, float] = (3.05, 8)
+# 1ホストあたりの同時接続数（表紙の並列取得・バッチ処理のワーカー数より多めに）
+POOL_MAXSIZE: int = 16
+# Retry-After に従って待つ上限（秒）。大きな値に付き合うと、表紙・ISBN の締め切り（COVER_DEADLINE /
+# ISBN_DEADLINE）より長く共有のワーカーを塞いでしまう
+RETRY_AFTER_MAX: float = 1.0
+
+
+class CappedRetry(Retry):
+    """Retry-After は尊重するが、RETRY_AFTER_MAX 秒より長くは待たない。"""
+
+    def get_retry_after(self, response) -> float | None:
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+
+
+# 一時的な失敗（接続エラー・429・5xx）だけを、指数バックオフで再試行する
+RETRY = CappedRetry(
+    total=2,
+    connect=2,
+    read=1,
+    status=2,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET", "HEAD"}),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+# 上流の代わりに向ける先（例: http://127.0.0.1:8765）。空なら本物の上流へ
+UPSTREAM_BASE_URL: str = os.environ.get("UPSTREAM_BASE_URL", "").rstrip("/")
+
+_sessions: dict[str, requests.Session] = {}
+_lock = threading.Lock()
+# 差し替え用のトランスポート（ベンチマークで記録済みの応答を返すときなど）。None なら通常の HTTP
+_transport: HTTPAdapter | None = None
+
+
+def _new_session() -> requests.Session:
+    s = requests.Session()
+    adapter = _transport or HTTPAdapter(
+        pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=RETRY, pool_block=False
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers["User-Agent"] = USER_AGENT
+    # Cookie を持たない（＝状態を持たない）のでスレッド間で共有しても安全
+    s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return s
+
+
+def upstream_url(url: str) -> str:
+    """UPSTREAM_BASE_URL が設定されていれば、上流の URL を代役のサーバーの URL に書き換える。"""
+    if not UPSTREAM_BASE_URL:
+        return url
+    u = urlsplit(url)
+    base = urlsplit(UPSTREAM_BASE_URL)
+    path = f"{base.path}/{u.netloc.lower()}{u.path or '/'}"
+    return urlunsplit((base.scheme, base.netloc, path, u.query, u.fragment))
+
+
+def get_session(url: str) -> requests.Session:
+    """URL のホストに対応する共有セッションを返す（無ければ作る）。"""
+    host = urlsplit(url).netloc.lower()
+    s = _sessions.get(host)
+    if s is None:
+        with _lock:
+            s = _sessions.get(host)
+            if s is None:
+                s = _sessions[host] = _new_session()
+    return s
+
+
+def _request(method: str, url: str, **kwargs) -> requests.Response:
+    """1回の呼び出し（再試行込み）を送り、ホスト・ステータス・バイト数・所要時間を記録する。"""
+    host = urlsplit(url).netloc.lower()
+    t0 = time.perf_counter()
+    try:
+        # セッション（コネクションプール）は書き換え前の上流ホストごとに分けたままにする
+        r = get_session(url).request(method, upstream_url(url), **kwargs)
+    except Exception:
+        record_upstream(host, "error", 0, time.perf_counter() - t0)
+        raise
+    # stream=True の本体はまだ読んでいないので Content-Length で数える
+    nbytes = int(r.headers.get("Content-Length") or 0) if kwargs.get("stream") else len(r.content)
+    record_upstream(host, r.status_code, nbytes, time.perf_counter() - t0)
+    return r
+
+
+def http_get(url: str, *, params: dict | None = None, headers: dict | None = None,
+             timeout: float | tuple[float, float] | None = None, **kwargs) -> requests.Response:
+    return _request("GET", url, params=params, headers=headers, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+
+
+def http_head(url: str, *, headers: dict | None = None,
+              timeout: float | tuple[float, float] | None = None, **kwargs) -> requests.Response:
+    kwargs.setdefault("allow_redirects", True)
+    return _request("HEAD", url, headers=headers, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+
+
+def set_transport(adapter: HTTPAdapter | None) -> None:
+    """以降のすべての上流呼び出しを adapter に流す（None で通常の HTTP に戻す）。既存のセッションは閉じる。"""
+    global _transport
+    close_all()
+    _transport = adapter
+
+
+def close_all() -> None:
+    """すべてのセッションを閉じる（テストやバッチの終了時用）。"""
+    with _lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
@@ -0,0 +1,374 @@
+"""タイトル（と著者）から ISBN-13 を引く（NDL SRU / Google Books）。
+
+find_isbn（lookup.py）の中身。問い合わせの候補は query_plans のプランを過去の当たり順に並べたもので、
+2通りの回し方がある。
+
+- sequential … 1件ずつ順に送り、NDL が全滅したら Google Books。上流への負荷が最も小さい。
+- fanout     … 候補を優先度順の「波」に分け、NDL と Google Books へ同時に送る。
+               最初に一致判定（書名の類似度 >= 0.55）を通った結果を採用し、残りは打ち切る。
+               全体の締め切りを超えたら見つからなかったものとして返す。
+
+カタログ全体の事前解決には resolve_bulk を使う。多数のタイトルを OR でまとめた1つの検索で引き、
+返ってきた書名を手元で要求タイトルに突き合わせる。
+"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+from http_client import DEFAULT_TIMEOUT, http_get
+from metrics import span
+from query_plans import Plan, QueryPlanner, default_plans, get_query_planner, render
+from title_index import TitleIndex, clean_title, similarity
+
+NDL_SRU_URL = "https://iss.ndl.go.jp/api/sru"
+GOOGLE_BOOKS_VOLUMES_URL = "https://www.googleapis.com/books/v1/volumes"
+# 返ってきた書名をこの類似度（title_index.similarity）以上で「同じ本」とみなす
+MATCH_RATIO: float = 0.55
+# NDL 検索で試す著者の表記ゆれ
+NDL_AUTHOR_ALIASES = ["マツダミヒロ", "マツダ ミヒロ", "松田充弘", "松田 充弘", "松田　充弘", "WAKANA"]
+
+# fanout: 1つの波で同時に送る問い合わせ数、次の波を待たずに始めるまでの秒数、全体の締め切り（秒）
+FANOUT_WAVE: int = 4
+FANOUT_STAGGER: float = 1.5
+ISBN_DEADLINE: float = 12.0
+# fanout 用の共有スレッドプール（表紙の並列取得・バッチのワーカーから同時に使われる）
+FANOUT_WORKERS: int = 8
+
+_NS = {"srw": "http://www.loc.gov/zing/srw/", "dc": "http://purl.org/dc/elements/1.1/"}
+
+
+def digits13(s: str | None) -> str | None:
+    digits = re.sub(r"[^0-9]", "", s or "")
+    return digits if len(digits) == 13 else None
+
+
+def title_matches(want: str, got: str) -> bool:
+    return similarity(want, got) >= MATCH_RATIO
+
+
+def query_titles(title: str) -> list[str]:
+    """検索に使うタイトルの形（先頭が副題を落とした本題、続いてさらに短い形）。"""
+    q_title = clean_title(str(title))
+    # additional: drop suffix after common separators
+    for sep in ["：", ":", " - ", "—", "–", "—", "―", "〜", "、"]:
+        if sep in q_title:
+            q_title = clean_title(q_title.split(sep)[0])
+            break
+    # try multiple title variants (remove subtitles)
+    title_variants = [q_title]
+    for sep in ["：", ":", " - ", "—", "(", "（"]:
+        if sep in q_title:
+            title_variants.append(clean_title(q_title.split(sep)[0]))
+    return list(dict.fromkeys([t for t in title_variants if t]))
+
+
+@dataclass(frozen=True)
+class IsbnQuery:
+    """1回の問い合わせ。source は "ndl" か "google"。plan は NDL のときだけ。"""
+    source: str
+    want: str
+    params: dict
+    plan: Plan | None = None
+
+
+def build_queries(title: str, author: str | None, planner: QueryPlanner, use_gb: bool,
+                  gb_key: str | None = None) -> tuple[list[IsbnQuery], IsbnQuery | None]:
+    """NDL の問い合わせ（当たりやすい順・重複なし）と、Google Books の問い合わせを組み立てる。"""
+    title_variants = query_titles(title)
+    q_title = title_variants[0] if title_variants else ""
+    q_author = clean_title(str(author)) if author else None
+    titles = {("full" if i == 0 else "short" if i == 1 else f"short{i}"): t for i, t in enumerate(title_variants)}
+    # try author variants (including common aliases) and None
+    authors = {"caller": q_author} if q_author else {}
+    authors.update({a: a for a in NDL_AUTHOR_ALIASES})
+
+    ndl: list[IsbnQuery] = []
+    seen: set[str] = set()
+    for plan in planner.order(default_plans(list(titles), [*authors, ""])):
+        t = titles[plan.title]
+        cql = render(plan, t, authors.get(plan.author))
+        if cql in seen:
+            continue
+        seen.add(cql)
+        ndl.append(IsbnQuery("ndl", t, {"operation": "searchRetrieve", "maximumRecords": "5", "query": cql}, plan))
+
+    google = None
+    if use_gb and q_title:
+        q = f'intitle:"{q_title}"'
+        if q_author:
+            q += f' inauthor:"{q_author}"'
+        gparams = {"q": q, "maxResults": 5, "printType": "books", "langRestrict": "ja"}
+        if gb_key:
+            gparams["key"] = gb_key
+        google = IsbnQuery("google", q_title, gparams)
+    return ndl, google
+
+
+def run_query(query: IsbnQuery, timeout: float | tuple[float, float] | None = None) -> tuple[str | None, int] | None:
+    """問い合わせを1回送り、(一致した ISBN か None, 返ってきた件数) を返す。上流の失敗なら None。"""
+    with span("isbn_query", source=query.source, plan=query.plan.key if query.plan else None) as s:
+        got = _run_query(query, timeout)
+        s["outcome"] = "error" if got is None else ("hit" if got[0] else "miss")
+        return got
+
+
+def _run_query(query: IsbnQuery, timeout: float | tuple[float, float] | None) -> tuple[str | None, int] | None:
+    if query.source == "ndl":
+        r = http_get(NDL_SRU_URL, params=query.params, timeout=timeout)
+        if not (r.ok and r.text):
+            return None
+        records = ET.fromstring(r.text).findall(".//srw:record", _NS)
+        for rec in records:
+            cand = None
+            for el in rec.findall(".//dc:identifier", _NS):
+                cand = digits13(el.text or "")
+                if cand:
+                    break
+            if not cand:
+                continue
+            dctitle = rec.find(".//dc:title", _NS)
+            if dctitle is not None and dctitle.text and title_matches(query.want, dctitle.text):
+                return cand, len(records)
+        return None, len(records)
+
+    r = http_get(GOOGLE_BOOKS_VOLUMES_URL, params=query.params, timeout=timeout)
+    if not r.ok:
+        return None
+    items = r.json().get("items", []) or []
+    for it in items:
+        vi = it.get("volumeInfo", {})
+        if not title_matches(query.want, vi.get("title", "")):
+            continue
+        for ident in vi.get("industryIdentifiers", []) or []:
+            if ident.get("type") == "ISBN_13":
+                cand = digits13(ident.get("identifier"))
+                if cand:
+                    return cand, len(items)
+    return None, len(items)
+
+
+def _known_empty(query: IsbnQuery, empty_titles: set[str]) -> bool:
+    # title any "t" が0件なら、そのタイトルで著者を絞った問い合わせも0件
+    return query.plan is not None and query.want in empty_titles
+
+
+def _note_result(planner: QueryPlanner, query: IsbnQuery, result: tuple[str | None, int] | None,
+                 seconds: float, empty_titles: set[str], failures: dict[str, str] | None) -> str | None:
+    if failures is not None:
+        # 情報源ごとの外れ方: 一度でも応答が返って一致しなければ "no_match"、応答すら無ければ "error"
+        if result is None:
+            failures.setdefault(query.source, "error")
+        elif result[0] is None:
+            failures[query.source] = "no_match"
+    # 上流の失敗はプランの当たり外れとは関係ないので記録しない
+    if result is None or query.plan is None:
+        return result[0] if result else None
+    hit, n_records = result
+    if not n_records and query.plan.template == "title_any":
+        empty_titles.add(query.want)
+    planner.record(query.plan, hit is not None, seconds)
+    return hit
+
+
+def resolve_sequential(title: str, author: str | None = None, *, use_gb: bool = True,
+                       gb_key: str | None = None, failures: dict[str, str] | None = None) -> str | None:
+    """NDL の候補を1件ずつ当たりやすい順に送り、全滅したら Google Books を引く。
+
+    failures を渡すと、見つからなかったときの情報源ごとの理由がそこに入る。
+    """
+    planner = get_query_planner()
+    try:
+        ndl, google = build_queries(title, author, planner, use_gb, gb_key)
+        empty_titles: set[str] = set()
+        for query in [*ndl, *([google] if google else [])]:
+            if _known_empty(query, empty_titles):
+                # 送らなくても外れと分かっているプランは、外れとして数える
+                planner.record(query.plan, False, 0.0, sent=False)
+                continue
+            started = time.perf_counter()
+            try:
+                result = run_query(query)
+            except Exception:
+                result = None
+            hit = _note_result(planner, query, result, time.perf_counter() - started, empty_titles, failures)
+            if hit:
+                return hit
+        return None
+    finally:
+        planner.save_if_due()
+
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="isbn-fanout")
+    return _pool
+
+
+def _attempt(query: IsbnQuery, stop: threading.Event, deadline_at: float):
+    """プールで動く1回分。打ち切り済み・締め切り後なら送らない。"""
+    remaining = deadline_at - time.monotonic()
+    if stop.is_set() or remaining <= 0:
+        return None, 0.0
+    started = time.perf_counter()
+    # 読み取りタイムアウトも残り時間で頭打ちにする（送った要求そのものは途中で止められないため）
+    timeout = (DEFAULT_TIMEOUT[0], max(0.5, min(DEFAULT_TIMEOUT[1], remaining)))
+    try:
+        result = run_query(query, timeout=timeout)
+    except Exception:
+        result = None
+    return result, time.perf_counter() - started
+
+
+def resolve_fanout(title: str, author: str | None = None, *, use_gb: bool = True, gb_key: str | None = None,
+                   deadline: float = ISBN_DEADLINE, failures: dict[str, str] | None = None) -> str | None:
+    """候補を優先度順の波に分けて同時に送り、最初に一致した ISBN を返す。
+
+    Google Books は NDL の最有力候補と同じ最初の波に入れる。波の全件が外れるか、
+    FANOUT_STAGGER 秒たっても決着しなければ次の波を送る。deadline 秒で打ち切る。
+    """
+    planner = get_query_planner()
+    deadline_at = time.monotonic() + deadline
+    stop = threading.Event()
+    pending: dict[Future, IsbnQuery] = {}
+    try:
+        ndl, google = build_queries(title, author, planner, use_gb, gb_key)
+        queue = ndl[:1] + ([google] if google else []) + ndl[1:]
+        empty_titles: set[str] = set()
+        pool = _get_pool()
+        next_wave_at = 0.0
+        while queue or pending:
+            now = time.monotonic()
+            if now >= deadline_at:
+                if failures is not None:
+                    failures["fanout"] = "deadline"
+                return None
+            if queue and (not pending or now >= next_wave_at):
+                wave: list[IsbnQuery] = []
+                while queue and len(wave) < FANOUT_WAVE:
+                    query = queue.pop(0)
+                    if _known_empty(query, empty_titles):
+                        planner.record(query.plan, False, 0.0, sent=False)
+                        continue
+                    wave.append(query)
+                for query in wave:
+                    pending[pool.submit(_attempt, query, stop, deadline_at)] = query
+                next_wave_at = now + FANOUT_STAGGER
+                if not pending:
+                    continue
+            timeout = deadline_at - now
+            if queue:
+                timeout = min(timeout, max(0.0, next_wave_at - now))
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                query = pending.pop(fut)
+                result, seconds = fut.result()
+                hit = _note_result(planner, query, result, seconds, empty_titles, failures)
+                if hit:
+                    return hit
+        return None
+    finally:
+        # 残りは打ち切る（まだ始まっていないものは送らずに終わる）
+        stop.set()
+        for fut in pending:
+            fut.cancel()
+        planner.save_if_due()
+
+
+# bulk: 1回の問い合わせに OR でまとめるタイトル数と、1ページの件数・最大ページ数
+BULK_BATCH: int = 10
+BULK_MAX_RECORDS: int = 200
+BULK_MAX_PAGES: int = 5
+
+
+def _ndl_records(root: ET.Element) -> list[tuple[str, str]]:
+    """SRU の応答から (ISBN-13, dc:title) を取り出す。"""
+    out = []
+    for rec in root.findall(".//srw:record", _NS):
+        isbn = None
+        for el in rec.findall(".//dc:identifier", _NS):
+            isbn = digits13(el.text or "")
+            if isbn:
+                break
+        dctitle = rec.find(".//dc:title", _NS)
+        if isbn and dctitle is not None and dctitle.text:
+            out.append((isbn, dctitle.text))
+    return out
+
+
+def _search_all(cql: str) -> list[tuple[str, str]]:
+    """startRecord でページをたどって、問い合わせに当たった記録をすべて返す。"""
+    records: list[tuple[str, str]] = []
+    start = 1
+    for _ in range(BULK_MAX_PAGES):
+        params = {"operation": "searchRetrieve", "maximumRecords": str(BULK_MAX_RECORDS),
+                  "startRecord": str(start), "query": cql}
+        r = http_get(NDL_SRU_URL, params=params)
+        if not (r.ok and r.text):
+            break
+        root = ET.fromstring(r.text)
+        records += _ndl_records(root)
+        nxt = root.findtext("srw:nextRecordPosition", default="", namespaces=_NS).strip()
+        if not nxt.isdigit() or int(nxt) <= start:
+            break
+        start = int(nxt)
+    return records
+
+
+def wanted_index(titles: list[str]) -> TitleIndex:
+    """要求タイトル（と副題を落とした形）の bigram 索引。"""
+    return TitleIndex({title: query_titles(title) for title in titles})
+
+
+def match_records(titles: list[str], records: list[tuple[str, str]],
+                  index: TitleIndex | None = None) -> dict[str, str]:
+    """返ってきた記録を、要求したタイトルに突き合わせる。
+
+    まとめて引くと他のタイトル向けの記録も混ざるので、各記録は最も似ているタイトル1つにだけ割り当て、
+    タイトルごとに最も似た記録を採る（「夫婦の魔法の質問」の記録を「人間関係の魔法の質問」に当てない）。
+    index を渡せば、titles 以外（例: 同じカタログの他の行）も割り当て先の候補になる。
+    """
+    index = index or wanted_index(titles)
+    wanted = set(titles)
+    best: dict[str, tuple[float, str]] = {}
+    for isbn, got in records:
+        hit = index.best(got, MATCH_RATIO)
+        if hit is None:
+            continue
+        title, score = hit
+        if title in wanted and score > best.get(title, (0.0, ""))[0]:
+            best[title] = (score, isbn)
+    return {title: isbn for title, (_, isbn) in best.items()}
+
+
+def resolve_bulk(titles: list[str], batch: int = BULK_BATCH) -> dict[str, str]:
+    """多数のタイトルの ISBN を、OR でまとめた NDL 検索で一括に引く（カタログ全体の事前解決用）。
+
+    見つかったタイトルだけを {タイトル: ISBN-13} で返す。残りは find_isbn で1冊ずつ引く。
+    """
+    found: dict[str, str] = {}
+    titles = list(dict.fromkeys(t for t in titles if t))
+    # 全タイトルの索引を1度だけ作り、どのページの記録も全タイトルに対して割り当てる
+    index = wanted_index(titles)
+    for i in range(0, len(titles), max(1, batch)):
+        chunk = titles[i:i + batch]
+        terms = [f'title="{query_titles(t)[0]}"' for t in chunk if query_titles(t)]
+        if not terms:
+            continue
+        try:
+            records = _search_all(" OR ".join(terms))
+        except Exception:
+            continue
+        found.update(match_records(chunk, records, index))
+    return found
@@ -0,0 +1,139 @@
+"""複数のキーワード辞書を1回の走査でまとめて照合するマッチャー（Aho-Corasick）。
+
+filter_books は「テーマ語・気持ち語・読み方語・ペナルティ語」の各辞書について、
+タイトル・説明・キーワード欄に1語でも含まれるかを見る。辞書ごと・欄ごとに
+キーワードを1つずつ `in` で調べると 行数 × 語数 × 辞書数 で重くなるので、
+全辞書の語から1つのオートマトンを作り、各欄を1回なめるだけで
+「どの辞書のどの項目に当たったか」をすべて拾う。
+"""
+from __future__ import annotations
+
+import threading
+from collections import deque
+
+import pandas as pd
+
+
+class KeywordMatcher:
+    """{辞書名: {項目: [キーワード, ...]}} から作る部分一致マッチャー（大文字小文字は区別しない）。"""
+
+    def __init__(self, dictionaries: dict[str, dict[str, list[str]]]):
+        self.dictionaries = dictionaries
+        # 項目 (辞書名, 項目名) の通し番号
+        self.entries: list[tuple[str, str]] = [
+            (name, entry) for name, d in dictionaries.items() for entry in d
+        ]
+        entry_ids = {e: i for i, e in enumerate(self.entries)}
+        # キーワード（小文字化して重複除去）→ それを含む項目番号
+        owners: dict[str, set[int]] = {}
+        for name, d in dictionaries.items():
+            for entry, words in d.items():
+                for w in words:
+                    w = (w or "").lower()
+                    if w:
+                        owners.setdefault(w, set()).add(entry_ids[(name, entry)])
+
+        # トライ木
+        self._goto: list[dict[str, int]] = [{}]
+        self._out: list[frozenset[int]] = [frozenset()]
+        for word, ids in owners.items():
+            node = 0
+            for ch in word:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._out.append(frozenset())
+                node = nxt
+            self._out[node] = self._out[node] | ids
+
+        # 失敗リンク（幅優先）。出力は失敗先のものも合わせて持たせておく
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] | self._out[self._fail[nxt]]
+
+    def scan(self, text: str) -> set[int]:
+        """text に含まれる語を持つ項目の番号をすべて返す。"""
+        if not isinstance(text, str) or not text:
+            return set()
+        goto, fail, out = self._goto, self._fail, self._out
+        found: set[int] = set()
+        node = 0
+        for ch in text.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+    def hit_table(self, df: pd.DataFrame, fields: dict[str, str]) -> pd.DataFrame:
+        """各行・各欄を1回ずつ走査し、(欄, 辞書名, 項目名) を列に持つ真偽表を返す。
+
+        fields は {欄の呼び名: df の列名}。
+        """
+        columns = pd.MultiIndex.from_tuples(
+            [(f, name, entry) for f in fields for name, entry in self.entries], names=["field", "dict", "entry"]
+        )
+        n = len(self.entries)
+        rows = []
+        for values in zip(*(df[col].astype(str) for col in fields.values())):
+            row = [False] * (n * len(fields))
+            for k, v in enumerate(values):
+                for i in self.scan(v):
+                    row[k * n + i] = True
+            rows.append(row)
+        return pd.DataFrame(rows, index=df.index, columns=columns, dtype=bool)
+
+
+def hit_column(table: pd.DataFrame, field: str, name: str, entry: str) -> pd.Series:
+    """真偽表から1列を取り出す（辞書に無い項目なら全行 False）。"""
+    key = (field, name, entry)
+    if key in table.columns:
+        return table[key]
+    return pd.Series(False, index=table.index)
+
+
+class IncrementalHitTable:
+    """hit_table を行単位で差分更新しながら持ち続ける入れ物（スレッドセーフ）。
+
+    update() にシートの版と「前回の版からの追加・変更・削除」が渡されれば、
+    その行だけを走査し直す。差分の基準が手元の版と合わないときは全件作り直す。
+    """
+
+    def __init__(self, matcher: KeywordMatcher, fields: dict[str, str], key: str = "title"):
+        self.matcher = matcher
+        self.fields = fields
+        self.key = key
+        self.version: str | None = None
+        self._by_key: pd.DataFrame | None = None
+        self._lock = threading.Lock()
+        self.rows_scanned = 0
+
+    def update(self, df: pd.DataFrame, version: str | None = None, base: str | None = None,
+               touched: set[str] | None = None, removed: list[str] | None = None) -> pd.DataFrame:
+        """df の各行に対応する真偽表（index は df と同じ）を返す。"""
+        with self._lock:
+            if version is None or version != self.version or self._by_key is None:
+                if self._by_key is not None and base is not None and base == self.version and touched is not None:
+                    keep = self._by_key.drop(index=[*touched, *(removed or [])], errors="ignore")
+                    todo = df[~df[self.key].isin(keep.index)]
+                else:
+                    keep = None
+                    todo = df
+                fresh = self.matcher.hit_table(todo, self.fields).set_axis(todo[self.key].to_numpy())
+                self.rows_scanned += len(todo)
+                by_key = fresh if keep is None else pd.concat([keep, fresh])
+                self._by_key = by_key[~by_key.index.duplicated(keep="last")]
+                self.version = version
+            table = self._by_key.reindex(df[self.key].to_numpy(), fill_value=False)
+        return table.set_axis(df.index)
@@ -0,0 +1,278 @@
+"""処理時間・上流呼び出し・キャッシュの当たり外れを数える、依存なしの軽いメトリクス。
+
+重い経路（load_books・filter_books・ISBN の問い合わせ・表紙の各取得手段・HTML の組み立て）を
+span() で囲むと、所要時間がヒストグラムに入る。上流への HTTP は http_client がホスト・ステータス・
+バイト数を記録し、キャッシュは cache_result() / cache_probe() で当たり・外れを数える。
+
+集計はプロセス内に持ち、Prometheus のテキスト形式（render_prometheus）で出す。
+METRICS_PORT を設定すると、そのポートの /metrics で配る（ensure_metrics_server）。
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+METRICS_HOST: str = os.environ.get("METRICS_HOST", "127.0.0.1")
+# 0 なら /metrics を配らない
+METRICS_PORT: int = int(os.environ.get("METRICS_PORT", "0"))
+# 名前の接頭辞
+PREFIX = "book_app"
+# 秒のヒストグラムの区切り（表紙の取得や ISBN の問い合わせは数百ミリ秒〜数秒）
+BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """区切りから分位点を見積もる（区切りの中は線形補間）。"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = BUCKETS[i - 1] if i else 0.0
+                hi = BUCKETS[i] if i < len(BUCKETS) else max(lo, self.sum / self.count)
+                return lo + (hi - lo) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """ヒストグラムとカウンターの置き場。スレッドセーフ。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._histograms: dict[str, dict[Labels, _Histogram]] = {}
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._help: dict[str, str] = {}
+
+    def observe(self, name: str, value: float, help: str = "", **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = _Histogram()
+            h.observe(value)
+            if help:
+                self._help.setdefault(name, help)
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render_prometheus(self) -> str:
+        """Prometheus のテキスト形式（version 0.0.4）で全系列を書き出す。"""
+        def fmt(labels: Labels, extra: tuple[tuple[str, str], ...] = ()) -> str:
+            pairs = [*labels, *extra]
+            if not pairs:
+                return ""
+            body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                            for k, v in pairs)
+            return "{" + body + "}"
+
+        lines: list[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full = f"{PREFIX}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{full}{fmt(labels)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                full = f"{PREFIX}_{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} histogram")
+                for labels, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS, h.counts):
+                        cumulative += n
+                        lines.append(f"{full}_bucket{fmt(labels, (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{full}_bucket{fmt(labels, (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{full}_sum{fmt(labels)} {h.sum:.6f}")
+                    lines.append(f"{full}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def timings(self) -> list[dict]:
+        """ヒストグラムの各系列の要約（件数・平均・p50・p95 をミリ秒で）。画面表示用。"""
+        with self._lock:
+            rows = [
+                {
+                    "metric": name,
+                    "labels": ", ".join(f"{k}={v}" for k, v in labels),
+                    "count": h.count,
+                    "mean_ms": 1000 * h.sum / h.count if h.count else 0.0,
+                    "p50_ms": 1000 * h.quantile(0.50),
+                    "p95_ms": 1000 * h.quantile(0.95),
+                }
+                for name, series in self._histograms.items()
+                for labels, h in series.items()
+            ]
+        rows.sort(key=lambda r: (r["metric"], -r["count"]))
+        return rows
+
+    def counters(self) -> list[dict]:
+        with self._lock:
+            rows = [
+                {"metric": name, "labels": ", ".join(f"{k}={v}" for k, v in labels), "value": value}
+                for name, series in self._counters.items()
+                for labels, value in series.items()
+            ]
+        rows.sort(key=lambda r: (r["metric"], r["labels"]))
+        return rows
+
+    def hit_rates(self) -> dict[str, float]:
+        """キャッシュごとの当たり率（cache_result / cache_probe で数えたもの）。"""
+        totals: dict[str, list[float]] = {}
+        with self._lock:
+            for labels, value in self._counters.get("cache_requests_total", {}).items():
+                d = dict(labels)
+                t = totals.setdefault(d.get("cache", ""), [0.0, 0.0])
+                t[0] += value if d.get("result") == "hit" else 0
+                t[1] += value
+        return {cache: hit / total for cache, (hit, total) in totals.items() if total}
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """プロセス共有の集計を返す。"""
+    return _metrics
+
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[dict]:
+    """囲んだ処理の所要時間を span_seconds{span=name, ...} に記録する。
+
+    yield した dict に書いたラベル（例: s["outcome"] = "hit"）も付く。
+    例外で抜けたときは outcome が未設定なら "error" にする。
+    """
+    extra: dict = {}
+    t0 = time.perf_counter()
+    try:
+        yield extra
+    except BaseException:
+        extra.setdefault("outcome", "error")
+        raise
+    finally:
+        _metrics.observe("span_seconds", time.perf_counter() - t0, help="Time spent in instrumented code paths.",
+                         **{**labels, **extra, "span": name})
+
+
+def record_upstream(host: str, status: int | str, nbytes: int, seconds: float) -> None:
+    """上流への HTTP 1回ぶん（http_client から呼ぶ）。status は数値か "error"。"""
+    _metrics.observe("upstream_seconds", seconds, help="Upstream HTTP request latency.", host=host, status=status)
+    _metrics.inc("upstream_requests_total", help="Upstream HTTP requests.", host=host, status=status)
+    if nbytes:
+        _metrics.inc("upstream_bytes_total", nbytes, help="Bytes received from upstreams.", host=host)
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    _metrics.inc("cache_requests_total", help="Cache lookups by cache and result.",
+                 cache=cache, result="hit" if hit else "miss")
+
+
+# cache_probe の入れ子ごとの「中身が実行されたか」の印（スレッドごと）
+_probes = threading.local()
+
+
+@contextmanager
+def cache_probe(cache: str) -> Iterator[None]:
+    """st.cache_data 付きの関数呼び出しを囲み、キャッシュの当たり・外れを数える。
+
+    関数の本体の先頭で computed() を呼んでおくと、本体が実行された（外れ）と分かる。
+    """
+    stack = _probes.__dict__.setdefault("stack", [])
+    stack.append(False)
+    try:
+        yield
+    finally:
+        ran = stack.pop()
+        cache_result(cache, hit=not ran)
+
+
+def computed() -> None:
+    """cache_probe に「キャッシュに無く、本体を実行した」ことを知らせる。"""
+    stack = getattr(_probes, "stack", None)
+    if stack:
+        stack[-1] = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = _metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+_server_started = False
+_server_lock = threading.Lock()
+
+
+def ensure_metrics_server() -> None:
+    """METRICS_PORT が設定されていれば /metrics を配るサーバーをプロセスに1つだけ起動する。
+
+    ポートが既に使われている場合は何もしない（別ワーカーが配っている）。
+    """
+    global _server_started
+    if _server_started or not METRICS_PORT:
+        return
+    with _server_lock:
+        if _server_started:
+            return
+        _server_started = True
+        try:
+            srv = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+        except OSError:
+            return
+        srv.daemon_threads = True
+        threading.Thread(target=srv.serve_forever, name="metrics-server", daemon=True).start()
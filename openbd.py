@@ -0,0 +1,115 @@
+"""OpenBD の書誌をまとめて先読みし、「どの ISBN に表紙があるか」を覚えておく。
+
+get_cover_url は ISBN ごとに /v1/cover/{isbn}.jpg を取りに行き、表紙が無い本では
+404 を受け取るまで分からない。OpenBD の /v1/get?isbn=a,b,c,... は多数の ISBN の書誌
+（summary.cover に表紙URL）を1回で返すので、カタログの既知の ISBN を一括で引いて
+cover_store に記録しておく。表紙の取得時はこの記録を見て、無いと分かっている ISBN には問い合わせない。
+"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+
+from cover_store import COVER_TTL, get_cover_store
+from http_client import http_get
+
+OPENBD_GET_URL = "https://api.openbd.jp/v1/get"
+OPENBD_COVER_URL = "https://api.openbd.jp/v1/cover/{isbn}.jpg"
+# 1回の /v1/get にまとめる ISBN の数（URL が長くなりすぎない程度に）
+OPENBD_BATCH: int = 100
+# 表紙ありの記録はストアと同じ期間、表紙なしの記録は短めの期間で確認し直す（後から登録されることがある）
+OPENBD_TTL: int = COVER_TTL
+OPENBD_MISS_TTL: int = 7 * 24 * 60 * 60
+# 問い合わせ中の ISBN を1件だけ必要とする側が、その結果を待つ上限（秒）
+OPENBD_INFLIGHT_WAIT: float = 5.0
+
+
+def normalize_isbn(isbn: str | None) -> str | None:
+    digits = re.sub(r"[^0-9Xx]", "", isbn or "").upper()
+    return digits if len(digits) in (10, 13) else None
+
+
+# 問い合わせ中の ISBN → 終わったら立つ Event（同じ ISBN を並行して二重に引かないため）
+_inflight: dict[str, threading.Event] = {}
+_inflight_lock = threading.Lock()
+
+
+def _fresh(url: str, checked_at: float) -> bool:
+    return (time.time() - checked_at) < (OPENBD_TTL if url else OPENBD_MISS_TTL)
+
+
+def prefetch_openbd(isbns: list[str | None], force: bool = False) -> dict[str, str]:
+    """ISBN の表紙有無をまとめて確認して記録し、{ISBN: 表紙URL（無ければ ""）} を返す。
+
+    記録が新しい ISBN には問い合わせない（force で無視）。OpenBD に届かなかった ISBN は結果に含めない。
+    """
+    store = get_cover_store()
+    wanted = list(dict.fromkeys(n for n in map(normalize_isbn, isbns) if n))
+    known = {} if force else store.get_openbd(wanted)
+    result = {isbn: url for isbn, (url, checked_at) in known.items() if _fresh(url, checked_at)}
+    todo = [isbn for isbn in wanted if isbn not in result]
+    done = threading.Event()
+    with _inflight_lock:
+        for isbn in todo:
+            _inflight.setdefault(isbn, done)
+    try:
+        for i in range(0, len(todo), OPENBD_BATCH):
+            chunk = todo[i:i + OPENBD_BATCH]
+            try:
+                r = http_get(OPENBD_GET_URL, params={"isbn": ",".join(chunk)})
+                records = r.json() if r.ok else None
+            except Exception:
+                records = None
+            # 応答は要求した ISBN と同じ順の配列（書誌が無ければ null）
+            if not isinstance(records, list) or len(records) != len(chunk):
+                continue
+            covers = {
+                isbn: ((rec or {}).get("summary") or {}).get("cover") or ""
+                for isbn, rec in zip(chunk, records)
+            }
+            store.put_openbd(covers)
+            result.update(covers)
+    finally:
+        with _inflight_lock:
+            for isbn in todo:
+                if _inflight.get(isbn) is done:
+                    del _inflight[isbn]
+        done.set()
+    return result
+
+
+def openbd_cover(isbn: str | None) -> str | None:
+    """表紙URLを返す。表紙が無いと分かっていれば ""、確認できなければ None。
+
+    記録が無い ISBN はその場で1件だけ書誌を引いて確認する（画像を当てずっぽうに取りに行かない）。
+    """
+    isbn = normalize_isbn(isbn)
+    if not isbn:
+        return None
+    # 一括の先読みがちょうどこの ISBN を引いているなら、その結果を待つ
+    with _inflight_lock:
+        pending = _inflight.get(isbn)
+    if pending is not None:
+        pending.wait(OPENBD_INFLIGHT_WAIT)
+    return prefetch_openbd([isbn]).get(isbn)
+
+
+_prefetched: set[str] = set()
+_prefetch_lock = threading.Lock()
+
+
+def prefetch_in_background(isbns: list[str | None], key: str) -> None:
+    """prefetch_openbd を裏のスレッドで1回だけ走らせる（key ごと。例: カタログの版）。"""
+    with _prefetch_lock:
+        if key in _prefetched:
+            return
+        _prefetched.add(key)
+
+    def _run() -> None:
+        try:
+            prefetch_openbd(isbns)
+        except Exception:
+            pass
+
+    threading.Thread(target=_run, name="openbd-prefetch", daemon=True).start()
@@ -0,0 +1,193 @@
+"""find_isbn の NDL 検索で「どの問い合わせの組み立て方が当たるか」を学習して並べ替える。
+
+NDL の検索は (タイトルの形, 著者の表記, CQL の型) の組み合わせを順に試すが、
+実際に当たる組み合わせは偏っている（例: 副題を落としたタイトル × 著者なしの title any）。
+組み合わせ（プラン）ごとに試行数・当たり数・応答時間を記録し、当たりやすいプランから試す。
+何度試しても一度も当たらないプランは刈り込み、ときどきだけ試し直す。
+
+統計は小さな JSON に保存し、プロセスの再起動をまたいで引き継ぐ。書き出しは検索のたびではなく、
+変更があったときに SAVE_INTERVAL 秒に1回までと、プロセスの終了時にまとめて行う。
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+# 統計の保存先（環境変数で差し替え可）
+QUERY_PLAN_STATS_PATH: str = os.environ.get(
+    "QUERY_PLAN_STATS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "query_plans.json"),
+)
+# この回数試して一度も当たらないプランは刈り込む
+PRUNE_AFTER: int = 30
+# 刈り込んだプランも、この回数に1回の解決では全部試す（上流の変化に追従するため）
+EXPLORE_EVERY: int = 25
+# 統計を書き出す最短の間隔（秒）。途中で落ちても失うのはこの間の統計だけ
+SAVE_INTERVAL: float = 60.0
+
+
+@dataclass(frozen=True)
+class Plan:
+    """問い合わせの組み立て方。具体的なタイトル文字列ではなく「形」で表す。
+
+    title:    "full"（副題込み）/ "short"（区切り記号より前だけ）
+    author:   "caller"（呼び出し側の著者名）/ 既知の別名そのもの / ""（著者なし）
+    template: CQL の型（TEMPLATES のキー）
+    """
+    title: str
+    author: str
+    template: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.title}|{self.author}|{self.template}"
+
+
+# CQL の型。{t} はタイトル、{a} は著者
+TEMPLATES: dict[str, str] = {
+    "title_creator_exact": 'title="{t}" AND creator="{a}"',
+    "title_creator_any": 'title any "{t}" AND creator any "{a}"',
+    "title_exact": 'title="{t}"',
+    "title_any": 'title any "{t}"',
+}
+
+
+def render(plan: Plan, title: str, author: str | None) -> str:
+    return TEMPLATES[plan.template].format(t=title, a=author or "")
+
+
+def default_plans(title_kinds: list[str], author_kinds: list[str]) -> list[Plan]:
+    """従来の入れ子ループと同じ順のプラン一覧（著者を使わない型は著者ごとに繰り返さない）。"""
+    plans: list[Plan] = []
+    for t in title_kinds:
+        for a in author_kinds:
+            names = ["title_creator_exact", "title_creator_any", "title_any"] if a else ["title_exact", "title_any"]
+            for name in names:
+                plans.append(Plan(t, a if name.startswith("title_creator") else "", name))
+    return list(dict.fromkeys(plans))
+
+
+class QueryPlanner:
+    """プランごとの当たり統計を持ち、試す順番を決める。スレッドセーフ。"""
+
+    def __init__(self, path: str | None = QUERY_PLAN_STATS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # key → {"tries", "hits", "seconds", "sent"}（sent は実際に問い合わせた回数）
+        self._stats: dict[str, dict[str, float]] = {}
+        self.resolutions = 0
+        self.requests = 0
+        self.skipped = 0
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._stats = {k: dict(v) for k, v in (data.get("plans") or {}).items()}
+
+    def save(self) -> None:
+        """統計を書き出す（一時ファイル経由で置き換える）。"""
+        if not self.path:
+            return
+        with self._lock:
+            payload = {"version": 1, "plans": {k: dict(v) for k, v in self._stats.items()}}
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def save_if_due(self) -> None:
+        """変更があり、前回の書き出しから SAVE_INTERVAL 秒たっていれば書き出す（検索のたびに呼んでよい）。"""
+        if self._dirty and time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+            self.save()
+
+    def flush(self) -> None:
+        """変更があれば今すぐ書き出す（プロセス終了時用）。"""
+        if self._dirty:
+            self.save()
+
+    def _score(self, plan: Plan) -> float:
+        s = self._stats.get(plan.key)
+        # 当たり率（ラプラス補正つき）。未試行のプランは 0.5 で、従来順の位置に残る
+        return ((s["hits"] if s else 0) + 1) / ((s["tries"] if s else 0) + 2)
+
+    def _pruned(self, plan: Plan) -> bool:
+        s = self._stats.get(plan.key)
+        return bool(s) and s["hits"] == 0 and s["tries"] >= PRUNE_AFTER
+
+    def order(self, plans: list[Plan]) -> list[Plan]:
+        """当たりやすい順に並べ、刈り込み対象を除いたプラン一覧を返す。"""
+        with self._lock:
+            self.resolutions += 1
+            explore = self.resolutions % EXPLORE_EVERY == 0
+            ranked = sorted(enumerate(plans), key=lambda ip: (-self._score(ip[1]), ip[0]))
+            kept = [p for _, p in ranked if explore or not self._pruned(p)]
+            self.skipped += len(plans) - len(kept)
+        return kept
+
+    def record(self, plan: Plan, hit: bool, seconds: float, sent: bool = True) -> None:
+        """1回の試行結果を記録する。sent=False は「送るまでもなく外れと分かった」試行。"""
+        with self._lock:
+            s = self._stats.setdefault(plan.key, {"tries": 0, "hits": 0, "seconds": 0.0, "sent": 0})
+            s["tries"] += 1
+            s["hits"] += int(hit)
+            self._dirty = True
+            if sent:
+                s["seconds"] += seconds
+                s["sent"] = s.get("sent", 0) + 1
+                self.requests += 1
+
+    def stats(self) -> dict:
+        """プランごとの試行数・当たり数・平均応答時間と、このプロセスでの合計を返す。"""
+        with self._lock:
+            plans = [
+                {
+                    "plan": key,
+                    "tries": int(s["tries"]),
+                    "hits": int(s["hits"]),
+                    "hit_rate": s["hits"] / s["tries"] if s["tries"] else 0.0,
+                    "mean_ms": 1000 * s["seconds"] / s["sent"] if s.get("sent") else 0.0,
+                    "pruned": s["hits"] == 0 and s["tries"] >= PRUNE_AFTER,
+                }
+                for key, s in self._stats.items()
+            ]
+            plans.sort(key=lambda p: (-p["hit_rate"], -p["tries"]))
+            return {
+                "resolutions": self.resolutions,
+                "requests": self.requests,
+                "requests_per_resolution": self.requests / self.resolutions if self.resolutions else 0.0,
+                "skipped": self.skipped,
+                "plans": plans,
+            }
+
+
+_planner: QueryPlanner | None = None
+_planner_lock = threading.Lock()
+
+
+def get_query_planner() -> QueryPlanner:
+    """プロセス共有のプランナーを返す（初回呼び出し時に統計を読み込む）。"""
+    global _planner
+    if _planner is None:
+        with _planner_lock:
+            if _planner is None:
+                _planner = QueryPlanner()
+                atexit.register(_planner.flush)
+    return _planner
@@ -0,0 +1,208 @@
+"""おすすめ本の選抜（キーワード辞書・スコアリング・段階選抜）。
+
+フォームの3つの選択（テーマ・気持ち・読み方）から、カタログの各行にスコアを付けて候補を絞る。
+辞書ヒットは keyword_matcher でまとめて求め、全組み合わせの結果はカタログの版ごとに1回だけ計算する。
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from keyword_matcher import IncrementalHitTable, KeywordMatcher, hit_column
+from metrics import span
+
+# --- 推薦ロジック用キーワード辞書 ---
+INTEREST_TO_KEYWORDS = {
+    "自己理解・内省": ["自己理解", "自分探し", "内省", "価値観", "自分軸", "問い", "質問"],
+    "習慣・ライフスタイル": ["習慣", "ルーティン", "時間術", "ライフスタイル", "朝活", "手放す"],
+    "仕事・キャリア": ["仕事", "キャリア", "ビジネス", "仕事術", "会社", "上司", "起業"],
+    "人間関係・コミュニケーション": ["人間関係", "コミュニケーション", "聞く", "会話", "傾聴", "質問力"],
+    "恋愛・パートナーシップ": ["恋愛", "パートナー", "夫婦", "関係", "愛"],
+    "子育て・教育": ["子育て", "教育", "親子", "先生", "学校", "子ども"],
+    "死生観・人生の意味": ["死", "人生の意味", "生き方", "幸福", "哲学"],
+}
+
+FEELING_TO_KEYWORDS = {
+    "前向きになりたい": ["モチベーション", "前向き", "元気", "情熱", "やる気", "ポジティブ", "勇気", "こころ"],
+    "迷いを整理したい": ["モヤモヤ", "悩み", "整理", "手放す", "やめる", "断捨離", "不安", "整理する"],
+    "自分の軸を確かめたい": ["自分軸", "価値観", "強み", "理想"],
+    "人間関係を整えたい": ["人間関係", "コミュニケーション", "傾聴", "会話", "上司", "部下", "パートナー", "恋愛"],
+    "小さく動き出したい": ["一歩", "背中を押す", "きっかけ", "スモールステップ"],
+}
+
+EXTRA_TO_KEYWORDS = {
+    # フォーマット/読み口を示す語に寄せる（テーマ語とは被らない）
+    "さらっと読みたい": [
+        "短編", "コラム", "要点", "まとめ", "Q&A", "箇条書き", "図解", "見開き", "マンガ", "読みやすい"
+    ],
+    "じっくり考えたい": [
+        "論考", "解説", "長文", "考察", "読み応え", "章末", "問いかけ", "エッセイ"
+    ],
+    "具体的に実践したい": [
+        "ワーク", "演習", "シート", "テンプレート", "チェックリスト", "ステップ", "手順", "実践ガイド"
+    ],
+}
+
+
+# 補足テーマ（不足時の関連ジャンル）
+RELATED_THEME = {
+    "恋愛・パートナーシップ": "人間関係・コミュニケーション",
+    "子育て・教育": "人間関係・コミュニケーション",
+    "死生観・人生の意味": "自己理解・内省",
+    "習慣・ライフスタイル": "自己理解・内省",
+    "仕事・キャリア": "人間関係・コミュニケーション",
+}
+
+# 補足ラベル（やさしい注釈）
+RELATED_THEME_LABELS = {
+    "恋愛・パートナーシップ": "ちょっと毛色は違いますが、人間関係のヒントになるかもしれませんね。",
+    "子育て・教育": "少し視点を変えて、教育の観点からも役立つかもしれませんね。",
+    "死生観・人生の意味": "自己理解のヒントとしても読めるかもしれませんね。",
+    "習慣・ライフスタイル": "日々に取り入れやすい小さな気づきになるかもしれませんね。",
+    "仕事・キャリア": "人との関わりの観点からも役立つかもしれませんね。",
+}
+
+# テーマから遠い語のペナルティ
+INTEREST_PENALTY = {
+    "自己理解・内省": ["恋愛", "パートナー", "夫婦", "子育て", "教育", "マーケティング", "起業", "ビジネス"],
+    "習慣・ライフスタイル": ["恋愛", "子育て", "マーケティング", "起業"],
+    "仕事・キャリア": ["恋愛", "子育て", "死", "死生観"],
+    "人間関係・コミュニケーション": ["起業", "マーケティング", "マンダラ", "時間術", "子育て", "教育", "親子", "学校"],
+    "恋愛・パートナーシップ": ["起業", "マーケティング", "仕事術"],
+    "子育て・教育": ["恋愛", "マーケティング", "起業"],
+    "死生観・人生の意味": ["マーケティング", "起業", "恋愛", "子育て"],
+}
+
+@st.cache_resource(show_spinner=False)
+def keyword_matcher() -> KeywordMatcher:
+    """全キーワード辞書から1つのマッチャーを作る（プロセスで1回）。"""
+    return KeywordMatcher({
+        "interest": INTEREST_TO_KEYWORDS,
+        "feeling": FEELING_TO_KEYWORDS,
+        "extra": EXTRA_TO_KEYWORDS,
+        "penalty": INTEREST_PENALTY,
+    })
+
+
+@st.cache_resource(show_spinner=False)
+def _hit_index() -> IncrementalHitTable:
+    return IncrementalHitTable(keyword_matcher(), {"title": "title", "desc": "description", "keys": "keywords"})
+
+
+def keyword_hits(df: pd.DataFrame) -> pd.DataFrame:
+    """タイトル・説明・キーワード欄を1回ずつ走査した、辞書ヒットの真偽表。
+
+    シートが更新されたときは load_books が付ける行差分を使い、追加・変更された行だけを走査し直す。
+    """
+    diff = df.attrs.get("diff")
+    return _hit_index().update(
+        df,
+        version=df.attrs.get("sheet_version"),
+        base=diff.base if diff is not None else None,
+        touched=diff.touched if diff is not None else None,
+        removed=diff.removed if diff is not None else None,
+    )
+
+# 軽いテーマ×気持ち ボーナス（+1）
+BONUS_MAP = {
+    ("仕事・キャリア", "小さく動き出したい"),
+    ("自己理解・内省", "自分の軸を確かめたい"),
+    ("人間関係・コミュニケーション", "人間関係を整えたい"),
+    ("恋愛・パートナーシップ", "人間関係を整えたい"),
+    ("習慣・ライフスタイル", "前向きになりたい"),
+    ("習慣・ライフスタイル", "小さく動き出したい"),
+    ("死生観・人生の意味", "迷いを整理したい"),
+}
+
+
+def score_books(hits: pd.DataFrame, interest_choice: str, feeling_choice: str, extra_choice: str = "") -> dict[str, np.ndarray]:
+    """辞書ヒット表から、各行のマッチ列と重みつきスコアを配列で返す。"""
+    cols = {
+        "mi_keys": hit_column(hits, "keys", "interest", interest_choice),
+        "mi_title": hit_column(hits, "title", "interest", interest_choice),
+        "mi_desc": hit_column(hits, "desc", "interest", interest_choice),
+        "mf_keys": hit_column(hits, "keys", "feeling", feeling_choice),
+        "mf_desc": hit_column(hits, "desc", "feeling", feeling_choice),
+        "mx_keys": hit_column(hits, "keys", "extra", extra_choice),
+        "penalty": hit_column(hits, "keys", "penalty", interest_choice),
+    }
+    cols = {k: v.to_numpy(dtype=bool) for k, v in cols.items()}
+    # weighted score
+    score = (
+        cols["mi_keys"] * 3
+        + cols["mi_title"] * 2
+        + cols["mi_desc"] * 1
+        + cols["mf_keys"] * 2
+        + cols["mf_desc"] * 1
+        + cols["mx_keys"] * 1
+        - cols["penalty"] * 1
+    ).astype(int)
+    if (interest_choice, feeling_choice) in BONUS_MAP:
+        score = score + 1
+    cols["score"] = score
+    return cols
+
+
+def tier_positions(cols: dict[str, np.ndarray]) -> np.ndarray:
+    """スコアの段階選抜（強い → 中くらい → ゆるい一致 → 全体）で残す行の位置を返す。"""
+    score = cols["score"]
+    strong = np.flatnonzero(score >= 4)
+    medium = np.flatnonzero((score >= 2) & (score < 4))
+    if len(strong) >= 3:
+        return strong
+    elif len(strong) + len(medium) >= 3:
+        return np.concatenate([strong, medium])[:30]
+    else:
+        # 最後の手として テーマ語・気持ち語 のどれかがキーワード欄か説明にマッチ
+        loose = np.flatnonzero(cols["mi_keys"] | cols["mf_keys"] | cols["mi_desc"] | cols["mf_desc"])
+        merged = np.concatenate([strong, medium, loose])
+        merged = merged[np.sort(np.unique(merged, return_index=True)[1])]  # 重複除去・順序維持
+        if len(merged) >= 3:
+            return merged[:30]
+        # それでも足りなければ全体
+        return np.arange(len(score))
+
+
+def _filter_with_hits(df: pd.DataFrame, hits: pd.DataFrame, interest_choice: str, feeling_choice: str,
+                      extra_choice: str = "") -> pd.DataFrame:
+    cols = score_books(hits, interest_choice, feeling_choice, extra_choice)
+    return df.assign(**cols).iloc[tier_positions(cols)]
+
+
+def filter_books(df: pd.DataFrame, interest_choice: str, feeling_choice: str, extra_choice: str = "") -> pd.DataFrame:
+    # キーワード欄が存在しない場合は全件
+    if "keywords" not in df.columns:
+        return df.copy()
+    with span("filter_books"):
+        # 辞書ヒットは各欄1回の走査でまとめて求めてあるので、ここでは列を拾って足し合わせるだけ
+        return _filter_with_hits(df, keyword_hits(df), interest_choice, feeling_choice, extra_choice)
+
+
+def warm_candidates(df: pd.DataFrame) -> None:
+    """カタログの新しいスナップショットが公開されたときに、その版の ranked_candidates を作っておく。
+
+    CatalogueHolder.on_publish に登録して使う（版が変わって最初に検索した人に計算を待たせない）。
+    """
+    version = df.attrs.get("version")
+    if version and "keywords" in df.columns:
+        ranked_candidates(version, df)
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def ranked_candidates(version: str, _df: pd.DataFrame) -> dict[tuple[str, str, str], pd.DataFrame]:
+    """フォームで選べる全組み合わせ（テーマ7 × 気持ち5 × 読み方3 = 105通り）の filter_books 結果。
+
+    カタログの版（version）ごとに1回だけ計算し、以降はクリックごとに辞書を引くだけにする。
+    結果はセッション間で共有されるので、呼び出し側で書き換えないこと。
+    """
+    if "keywords" not in _df.columns:
+        return {}
+    with span("ranked_candidates"):
+        hits = keyword_hits(_df)
+        return {
+            (i, f, e): _filter_with_hits(_df, hits, i, f, e)
+            for i in INTEREST_TO_KEYWORDS
+            for f in FEELING_TO_KEYWORDS
+            for e in EXTRA_TO_KEYWORDS
+        }
@@ -0,0 +1,79 @@
+"""表紙のサムネイル化（表示サイズに縮小して WebP / プログレッシブ JPEG に再エンコード）。
+
+上流の表紙は数百px・数十KBあるが、カードでは最大 170×200 CSS px でしか表示しない。
+表示サイズ（高密度ディスプレイ向けに2倍）まで縮めてから配ることで、
+ページに埋め込む data URI を大幅に小さくする。作った縮小版は cover_store に保存して使い回す。
+"""
+from __future__ import annotations
+
+import io
+
+from cover_store import CoverStore
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow が無い環境では元画像をそのまま使う
+    Image = None
+    features = None
+
+# カードの表紙枠（CSS px）と、高密度ディスプレイ向けの倍率
+THUMB_BOX: tuple[int, int] = (170, 200)
+THUMB_SCALE: int = 2
+THUMB_QUALITY: int = 80
+
+
+def _thumb_format() -> str:
+    return "webp" if features is not None and features.check("webp") else "jpeg"
+
+
+def variant_name(box: tuple[int, int] = THUMB_BOX, scale: int = THUMB_SCALE) -> str:
+    return f"thumb-{box[0] * scale}x{box[1] * scale}.{_thumb_format()}"
+
+
+def make_thumbnail(data: bytes, box: tuple[int, int] = THUMB_BOX, scale: int = THUMB_SCALE,
+                   quality: int = THUMB_QUALITY) -> tuple[bytes, str] | None:
+    """画像を枠に収まるよう縮小して再エンコードする。できない場合は None。"""
+    if Image is None:
+        return None
+    size = (box[0] * scale, box[1] * scale)
+    try:
+        img = Image.open(io.BytesIO(data))
+        # JPEG はデコード時点で縮小できるので、大きな表紙でも軽く済む
+        img.draft("RGB", size)
+        img.thumbnail(size, Image.LANCZOS)
+        fmt = _thumb_format()
+        out = io.BytesIO()
+        if fmt == "webp":
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            img.save(out, "WEBP", quality=quality, method=4)
+            return out.getvalue(), "image/webp"
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue(), "image/jpeg"
+    except Exception:
+        return None
+
+
+def get_thumbnail(store: CoverStore, digest: str, data: bytes, content_type: str) -> tuple[bytes, str]:
+    """縮小版を返す（保存済みならそれを、無ければ作って保存）。元より大きくなるなら元画像を返す。
+
+    返した画像は必ず variant_name() の名前でストアに入っている（画像サーバーから配れる）。
+    """
+    variant = variant_name()
+    try:
+        hit = store.get_variant(digest, variant)
+    except Exception:
+        hit = None
+    if hit is not None:
+        return hit
+    thumb = make_thumbnail(data)
+    if thumb is None or len(thumb[0]) >= len(data):
+        # 縮小しても得をしない画像は、元画像を派生画像として覚えて次回の再計算を省く
+        thumb = (data, content_type)
+    try:
+        store.put_variant(digest, variant, *thumb)
+    except Exception:
+        pass
+    return thumb
@@ -0,0 +1,96 @@
+"""書名の文字 bigram 索引（表記ゆれに強い、速い類似度判定）。
+
+API が返した書名が「探している本」かどうかは、これまで候補1件ごとに
+difflib.SequenceMatcher で比べていた。日本語の書名は単語の区切りが無いので、
+正規化した書名を2文字ずつの組（bigram）に分け、共有する組の割合（Dice 係数）で似ているかを測る。
+探している書名の側を索引にしておけば、多数の記録をまとめて全タイトルと一度に突き合わせられる。
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from functools import lru_cache
+
+from cover_store import normalize_title
+
+
+def clean_title(s: str) -> str:
+    s = s or ""
+    # Unicode normalize (NFKC) to reduce width/variant differences
+    s = unicodedata.normalize("NFKC", s)
+    # remove bracketed notes entirely (e.g., （正式タイトル：…）)
+    s = re.sub(r"（.*?）", " ", s)
+    s = re.sub(r"\(.*?\)", " ", s)
+    s = s.strip()
+    # remove Japanese quotes/parentheses and extra spaces
+    s = re.sub(r"[『』「」（）()\[\]【】]", " ", s)
+    s = re.sub(r"\s+", " ", s)
+    return s
+
+
+@lru_cache(maxsize=4096)
+def bigrams(title: str) -> frozenset[str]:
+    """書名を正規化して（括弧書き・記号・空白を落とし、小文字化）文字 bigram の集合にする。"""
+    s = normalize_title(clean_title(title))
+    if len(s) < 2:
+        return frozenset([s]) if s else frozenset()
+    return frozenset(s[i:i + 2] for i in range(len(s) - 1))
+
+
+def similarity(a: str, b: str) -> float:
+    """2つの書名の類似度（bigram の Dice 係数、0〜1）。"""
+    ga, gb = bigrams(a), bigrams(b)
+    if not ga or not gb:
+        return 0.0
+    return 2 * len(ga & gb) / (len(ga) + len(gb))
+
+
+class TitleIndex:
+    """{キー: [書名の形, ...]} の bigram 転置索引。
+
+    1つのキー（例: シートの行タイトル）に、副題を落とした形など複数の書名を登録できる。
+    match() は与えた書名と bigram を共有する書名だけを数え上げるので、登録数が増えても速い。
+    """
+
+    def __init__(self, titles: dict[str, list[str]]):
+        self._keys: list[str] = []
+        self._sizes: list[int] = []
+        self._postings: dict[str, list[int]] = {}
+        for key, forms in titles.items():
+            for form in dict.fromkeys(forms):
+                grams = bigrams(form)
+                if not grams:
+                    continue
+                entry = len(self._keys)
+                self._keys.append(key)
+                self._sizes.append(len(grams))
+                for g in grams:
+                    self._postings.setdefault(g, []).append(entry)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def scores(self, title: str) -> dict[str, float]:
+        """登録済みの各キーとの類似度（共有する bigram が1つも無いキーは含めない）。"""
+        grams = bigrams(title)
+        if not grams:
+            return {}
+        shared: dict[int, int] = {}
+        for g in grams:
+            for entry in self._postings.get(g, ()):
+                shared[entry] = shared.get(entry, 0) + 1
+        out: dict[str, float] = {}
+        for entry, n in shared.items():
+            score = 2 * n / (len(grams) + self._sizes[entry])
+            key = self._keys[entry]
+            if score > out.get(key, 0.0):
+                out[key] = score
+        return out
+
+    def best(self, title: str, threshold: float = 0.0) -> tuple[str, float] | None:
+        """最も似ているキーと類似度。threshold 未満なら None。"""
+        scores = self.scores(title)
+        if not scores:
+            return None
+        key = max(scores, key=scores.__getitem__)
+        return (key, scores[key]) if scores[key] >= threshold else None
@@ -0,0 +1,258 @@
+"""記録済みの上流応答で、表示までの重い経路を測るオフラインのベンチマーク。
+
+シート・NDL・OpenBD・Google Books への呼び出しは tools/fixtures/ の応答で置き換える（ネットワーク不要）。
+測る経路と、cold / warm の意味:
+
+- load_books   … シートの取得・パース・マニフェスト結合。cold は前回の取得状態なし、warm は本文が同じで再パースを省く場合
+- filter_books … キーワード索引づくり＋採点。cold は索引を作り直す、warm は索引・候補表が温まった状態
+- find_isbn    … ISBN の無い行のタイトルから ISBN を引く。cold は空のストア・キャッシュなし（NDL のプラン統計は引き継ぐ）、warm は結果がキャッシュ済み
+- cover_url    … get_cover_url。cold は空のストア、warm はストアに表紙がある（再起動後と同じく st.cache_data は空）
+- result_page  … 候補の選出→表紙3冊→カード HTML・ページ HTML まで。cold / warm は cover_url と同じ（warm はカードも組み立て済み）
+
+各経路の p50 / p95（ミリ秒）と、1回あたりの上流リクエスト数・受信バイト数を出す。
+--baseline に前回の --json の出力を渡すと、--tolerance を超えて悪化していれば終了コード 1 で終わる（デプロイ前のチェック用）。
+
+使い方（リポジトリ直下で）:
+    python -m tools.bench                          # 表で表示
+    python -m tools.bench --json > bench.json      # 基準値として保存
+    python -m tools.bench --baseline bench.json    # 基準値と比べる
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+# ベンチマーク用の一時ディレクトリ。本番のストア・マニフェスト・統計には触らない
+_WORKDIR = tempfile.mkdtemp(prefix="book-bench-")
+os.environ["COVER_STORE_PATH"] = os.path.join(_WORKDIR, "covers.sqlite3")
+os.environ["ENRICHMENT_MANIFEST_PATH"] = os.path.join(_WORKDIR, "manifest.json")
+os.environ["QUERY_PLAN_STATS_PATH"] = os.path.join(_WORKDIR, "query_plans.json")
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+import pandas as pd  # noqa: E402
+
+import http_client  # noqa: E402
+from cards import book_card_html, get_card_fragments, results_html  # noqa: E402
+from catalogue import _SheetState, apply_manifest, build_books, load_manifest, refresh_sheet  # noqa: E402
+from cover_store import CoverStore, set_cover_store  # noqa: E402
+from lookup import clear_lookup_caches, find_isbn, get_cover_url, guess_author_from_keywords, resolve_covers  # noqa: E402
+from recommend import _hit_index, filter_books, keyword_matcher, ranked_candidates  # noqa: E402
+from tools.fixture_upstream import ReplayAdapter  # noqa: E402
+
+# 比べるときに許す悪化の割合（p50・リクエスト数・バイト数。p95 は揺れが大きいのでこの2倍まで許す）。
+# リクエスト数も fanout の打ち切りや並列取得の順番で少し揺れる
+DEFAULT_TOLERANCE: float = 0.5
+# これより小さい時間の差（ミリ秒）は揺らぎとみなして悪化に数えない
+MIN_DELTA_MS: float = 2.0
+# 選択肢の組み合わせ（filter_books / result_page で順に使う）
+CHOICES = [
+    ("自己理解・内省", "自分の軸を確かめたい", "じっくり考えたい"),
+    ("仕事・キャリア", "前向きになりたい", "具体的に実践したい"),
+    ("人間関係・コミュニケーション", "人間関係を整えたい", "さらっと読みたい"),
+    ("恋愛・パートナーシップ", "迷いを整理したい", "じっくり考えたい"),
+    ("子育て・教育", "小さく動き出したい", "具体的に実践したい"),
+    ("習慣・ライフスタイル", "小さく動き出したい", "さらっと読みたい"),
+    ("死生観・人生の意味", "迷いを整理したい", "じっくり考えたい"),
+]
+
+
+@dataclass
+class Scenario:
+    """測る経路1つ。run(i, cold) は i 回目の処理。
+
+    cold_reset は cold の各回の前に、warm_reset は warm の各回の前に呼ぶ（計測には含めない）。
+    """
+    name: str
+    run: Callable[[int, bool], object]
+    cold_reset: Callable[[], None]
+    warm_reset: Callable[[], None] = lambda: None
+
+
+@dataclass
+class Result:
+    name: str
+    mode: str
+    iterations: int
+    p50_ms: float
+    p95_ms: float
+    requests: float
+    bytes: float
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.mode}"
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))]
+
+
+_stores = 0
+
+
+def _fresh_store() -> None:
+    global _stores
+    _stores += 1
+    set_cover_store(CoverStore(os.path.join(_WORKDIR, f"covers-{_stores}.sqlite3")))
+
+
+def _pick3(books: pd.DataFrame, choice: tuple[str, str, str]) -> pd.DataFrame:
+    """app.py と同じく候補表から選ぶ（乱数の代わりに上位3冊。足りなければ全体の先頭で補う）。"""
+    table = ranked_candidates(books.attrs["version"], books)
+    candidates = table.get(choice)
+    if candidates is None:
+        candidates = filter_books(books, *choice)
+    picks = candidates.sort_values("score", ascending=False).head(3) if len(candidates) else candidates
+    if len(picks) < 3:
+        rest = books.drop(picks.index, errors="ignore").head(3 - len(picks))
+        picks = pd.concat([picks, rest])
+    return picks.reset_index(drop=True)
+
+
+def _result_page(books: pd.DataFrame, choice: tuple[str, str, str]) -> str:
+    picks = _pick3(books, choice)
+    covers = resolve_covers(picks)
+    book_ids = books.attrs.get("row_hashes", {})
+    cards = []
+    for (_, book), src in zip(picks.iterrows(), covers):
+        cards.append(book_card_html(
+            "hero" if not cards else "book", book_ids.get(book["title"]), book["title"], book["description"],
+            guess_author_from_keywords(book.get("keywords", "")), src, layout="native",
+        ))
+    return results_html("hero", cards[0], "others", cards[1:])
+
+
+def scenarios(books: pd.DataFrame, titles: int) -> list[Scenario]:
+    def load(i: int, cold: bool) -> pd.DataFrame | None:
+        if not cold:
+            return build_books()
+        sheet = refresh_sheet(_SheetState()).sheet
+        return None if sheet is None else apply_manifest(sheet, load_manifest())
+
+    def clear_matcher() -> None:
+        keyword_matcher.clear()
+        _hit_index.clear()
+        ranked_candidates.clear()
+
+    unresolved = [
+        (t, guess_author_from_keywords(k))
+        for t, k, isbn in zip(books["title"], books["keywords"], books["isbn"]) if not isbn
+    ][:titles]
+    with_isbn = [
+        (isbn or None, t, guess_author_from_keywords(k))
+        for t, k, isbn in zip(books["title"], books["keywords"], books["isbn"])
+    ][:titles]
+
+    def cover_reset() -> None:
+        _fresh_store()
+        clear_lookup_caches()
+        get_card_fragments().clear()
+
+    return [
+        Scenario("load_books", load, lambda: None),
+        Scenario("filter_books", lambda i, cold: filter_books(books, *CHOICES[i % len(CHOICES)]), clear_matcher),
+        Scenario("find_isbn", lambda i, cold: find_isbn(*unresolved[i % len(unresolved)]), cover_reset),
+        # 表紙はストアに残したまま、プロセス内のキャッシュだけ空にして測る（再起動後の表示と同じ）
+        Scenario("cover_url", lambda i, cold: get_cover_url(*with_isbn[i % len(with_isbn)]),
+                 cover_reset, clear_lookup_caches),
+        Scenario("result_page", lambda i, cold: _result_page(books, CHOICES[i % len(CHOICES)]),
+                 cover_reset, clear_lookup_caches),
+    ]
+
+
+def measure(scenario: Scenario, adapter: ReplayAdapter, mode: str, iterations: int) -> Result:
+    cold = mode == "cold"
+    samples: list[float] = []
+    requests = nbytes = 0
+    if not cold:
+        # warm は同じ入力を一巡させて、キャッシュ・ストアが温まった状態から測る
+        for i in range(iterations):
+            scenario.run(i, False)
+    for i in range(iterations):
+        (scenario.cold_reset if cold else scenario.warm_reset)()
+        adapter.reset_counts()
+        t0 = time.perf_counter()
+        scenario.run(i, cold)
+        samples.append((time.perf_counter() - t0) * 1000)
+        n, b = adapter.totals()
+        requests += n
+        nbytes += b
+    return Result(scenario.name, mode, iterations, _percentile(samples, 0.50), _percentile(samples, 0.95),
+                  requests / iterations, nbytes / iterations)
+
+
+def compare(results: list[Result], baseline: dict, tolerance: float, min_delta_ms: float = MIN_DELTA_MS) -> list[str]:
+    """基準値より悪化した項目の説明を返す（無ければ空）。"""
+    base = {f"{r['name']}:{r['mode']}": r for r in baseline.get("results", [])}
+    problems = []
+    for r in results:
+        b = base.get(r.key)
+        if b is None:
+            continue
+        if r.p50_ms > b["p50_ms"] * (1 + tolerance) and r.p50_ms - b["p50_ms"] > min_delta_ms:
+            problems.append(f"{r.key}: p50 {b['p50_ms']:.1f} -> {r.p50_ms:.1f} ms")
+        if r.p95_ms > b["p95_ms"] * (1 + 2 * tolerance) and r.p95_ms - b["p95_ms"] > min_delta_ms:
+            problems.append(f"{r.key}: p95 {b['p95_ms']:.1f} -> {r.p95_ms:.1f} ms")
+        if r.requests > b["requests"] * (1 + tolerance):
+            problems.append(f"{r.key}: requests/iter {b['requests']:.2f} -> {r.requests:.2f}")
+        if r.bytes > b["bytes"] * (1 + tolerance):
+            problems.append(f"{r.key}: bytes/iter {b['bytes']:.0f} -> {r.bytes:.0f}")
+    return problems
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20, help="各経路・各モードの計測回数")
+    parser.add_argument("--titles", type=int, default=12, help="find_isbn / cover_url で順に使うタイトル数")
+    parser.add_argument("--latency", type=float, default=0.0, help="上流1リクエストあたりに足す待ち時間（秒）")
+    parser.add_argument("--only", default="", help="測る経路をカンマ区切りで絞る（例: find_isbn,cover_url）")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出す（--baseline に渡せる）")
+    parser.add_argument("--baseline", default=None, help="比べる基準値（以前の --json の出力）")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="許す悪化の割合（p95 はこの2倍）")
+    parser.add_argument("--min-delta-ms", type=float, default=MIN_DELTA_MS, help="揺らぎとみなす p95 の差（ミリ秒）")
+    args = parser.parse_args(argv)
+
+    adapter = ReplayAdapter(latency=args.latency)
+    http_client.set_transport(adapter)
+    _fresh_store()
+    books = build_books()
+    if books is None or books.empty:
+        print("fixtures からカタログを読めませんでした", file=sys.stderr)
+        return 1
+
+    only = {s for s in args.only.split(",") if s}
+    results = []
+    for scenario in scenarios(books, args.titles):
+        if only and scenario.name not in only:
+            continue
+        for mode in ("cold", "warm"):
+            results.append(measure(scenario, adapter, mode, args.iterations))
+    http_client.set_transport(None)
+
+    if args.json:
+        json.dump({"iterations": args.iterations, "latency": args.latency,
+                   "results": [r.__dict__ for r in results]}, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+    else:
+        print(f"{'path':<14}{'mode':<6}{'p50 ms':>10}{'p95 ms':>10}{'req/iter':>10}{'bytes/iter':>12}")
+        for r in results:
+            print(f"{r.name:<14}{r.mode:<6}{r.p50_ms:>10.2f}{r.p95_ms:>10.2f}{r.requests:>10.2f}{r.bytes:>12.0f}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""filter_books（辞書ヒット表による採点）が、1語ずつ `in` で調べていた元の実装と同じ行を選ぶかの確認。
+
+キーワード辞書の語・大文字小文字違い・無関係な語を混ぜた架空のカタログを乱数で作り、
+フォームの全組み合わせ（105通り）について、選ばれた行（順番込み）とスコアを元の実装と突き合わせる。
+keyword_matcher.py や recommend.py の採点・段階選抜を変えたときに流す。
+
+使い方（リポジトリ直下で）:
+    python -m tools.check_filter                   # 20 カタログ
+    python -m tools.check_filter --catalogues 100 --seed 7
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+import pandas as pd  # noqa: E402
+
+from recommend import (  # noqa: E402
+    BONUS_MAP,
+    EXTRA_TO_KEYWORDS,
+    FEELING_TO_KEYWORDS,
+    INTEREST_PENALTY,
+    INTEREST_TO_KEYWORDS,
+    _hit_index,
+    filter_books,
+)
+
+# 辞書に無い語（部分一致の誤検出が起きないかも見る）
+_NOISE = ["本", "こと", "ひと", "日々", "物語", "ノート", "入門", "考", "生", "ステ", "Q", "&A", "自分", "関"]
+
+
+def _match_any_keyword(cell: str, kw_list: list[str]) -> bool:
+    if not isinstance(cell, str):
+        return False
+    text = cell.lower()
+    return any(k.lower() in text for k in kw_list)
+
+
+def reference_filter_books(df: pd.DataFrame, interest_choice: str, feeling_choice: str,
+                           extra_choice: str = "") -> pd.DataFrame:
+    """辞書ヒット表を入れる前の filter_books（欄ごと・辞書ごとに .apply で1語ずつ調べる）。"""
+    interest_kw = INTEREST_TO_KEYWORDS.get(interest_choice, [])
+    feeling_kw = FEELING_TO_KEYWORDS.get(feeling_choice, [])
+    combined_kw = list(dict.fromkeys(interest_kw + feeling_kw))
+    penalty_kw = INTEREST_PENALTY.get(interest_choice, [])
+    extra_kw = EXTRA_TO_KEYWORDS.get(extra_choice, [])
+    if "keywords" not in df.columns:
+        return df.copy()
+    df = df.copy()
+    df["_title"] = df["title"].astype(str).str.lower()
+    df["_desc"] = df["description"].astype(str).str.lower()
+    df["_keys"] = df["keywords"].astype(str).str.lower()
+    mi_keys = df["_keys"].apply(lambda s: _match_any_keyword(s, interest_kw))
+    mi_title = df["_title"].apply(lambda s: _match_any_keyword(s, interest_kw))
+    mi_desc = df["_desc"].apply(lambda s: _match_any_keyword(s, interest_kw))
+    mf_keys = df["_keys"].apply(lambda s: _match_any_keyword(s, feeling_kw))
+    mf_desc = df["_desc"].apply(lambda s: _match_any_keyword(s, feeling_kw))
+    mx_keys = df["_keys"].apply(lambda s: _match_any_keyword(s, extra_kw))
+    penalty = df["_keys"].apply(lambda s: _match_any_keyword(s, penalty_kw))
+    df["score"] = (
+        mi_keys.astype(int) * 3 + mi_title.astype(int) * 2 + mi_desc.astype(int)
+        + mf_keys.astype(int) * 2 + mf_desc.astype(int) + mx_keys.astype(int) - penalty.astype(int)
+    )
+    if (interest_choice, feeling_choice) in BONUS_MAP:
+        df["score"] = df["score"] + 1
+    strong = df[df["score"] >= 4]
+    medium = df[(df["score"] >= 2) & (df["score"] < 4)]
+    if len(strong) >= 3:
+        return strong
+    elif len(strong) + len(medium) >= 3:
+        return pd.concat([strong, medium]).head(30)
+    loose = df[df["_keys"].apply(lambda s: _match_any_keyword(s, combined_kw))
+               | df["_desc"].apply(lambda s: _match_any_keyword(s, combined_kw))]
+    merged = pd.concat([strong, medium, loose]).drop_duplicates()
+    if len(merged) >= 3:
+        return merged.head(30)
+    return df
+
+
+def random_catalogue(rng: random.Random, rows: int) -> pd.DataFrame:
+    vocab = sorted({
+        w for d in (INTEREST_TO_KEYWORDS, FEELING_TO_KEYWORDS, EXTRA_TO_KEYWORDS, INTEREST_PENALTY)
+        for words in d.values() for w in words
+    })
+
+    def text(n: int) -> str:
+        words = [rng.choice(vocab) if rng.random() < 0.4 else rng.choice(_NOISE) for _ in range(n)]
+        words = [w.upper() if rng.random() < 0.1 else w for w in words]
+        return rng.choice(["", " ", "、"]).join(words)
+
+    # 行はタイトルの通し番号で必ず異なる（元の実装の drop_duplicates が行の中身で重複を落とすため）
+    return pd.DataFrame({
+        "title": [f"{text(rng.randint(0, 3))}{i}" for i in range(rows)],
+        "description": [text(rng.randint(0, 8)) if rng.random() > 0.05 else None for _ in range(rows)],
+        "amazon_url": [""] * rows,
+        "keywords": [text(rng.randint(0, 5)) if rng.random() > 0.05 else None for _ in range(rows)],
+        "isbn": [""] * rows,
+    })
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--catalogues", type=int, default=20, help="作るカタログの数")
+    parser.add_argument("--rows", type=int, default=60, help="1カタログの最大行数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    checked = mismatches = 0
+    for n in range(args.catalogues):
+        df = random_catalogue(rng, rng.randint(1, args.rows))
+        # 行差分による索引の使い回しを挟まず、カタログごとに作り直す
+        _hit_index.clear()
+        for i in INTEREST_TO_KEYWORDS:
+            for f in FEELING_TO_KEYWORDS:
+                for e in EXTRA_TO_KEYWORDS:
+                    got = filter_books(df, i, f, e)
+                    want = reference_filter_books(df, i, f, e)
+                    checked += 1
+                    if list(got.index) != list(want.index) or list(got["score"]) != list(want["score"]):
+                        mismatches += 1
+                        if mismatches <= 5:
+                            print(f"catalogue {n} ({len(df)} rows) {i} / {f} / {e}: "
+                                  f"got {list(got.index)[:10]}, want {list(want.index)[:10]}")
+    print(f"{checked} selections checked, {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
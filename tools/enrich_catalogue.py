@@ -0,0 +1,141 @@
+"""カタログ全件の ISBN と表紙を事前に解決して、マニフェストに書き出すバッチ。
+
+ページ表示時の find_isbn / get_cover_url は「その本が初めて選ばれたとき」に
+ネットワークへ行くため、最初の訪問者が数秒待たされる。ここで全行を先に解決し、
+表紙は cover_store に、タイトル → ISBN / 表紙ハッシュは data/enrichment_manifest.json に残す。
+load_books() がマニフェストを結合するので、通常の表示ではほぼネットワークに行かない。
+
+使い方（リポジトリ直下で）:
+    python -m tools.enrich_catalogue             # 未解決の行と、シートで内容が変わった行だけ
+    python -m tools.enrich_catalogue --force     # 全行やり直し
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+# バッチ実行では Streamlit の「ランタイムが無い」警告は不要
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+from catalogue import load_books, load_manifest, save_manifest
+from cover_store import get_cover_store, isbn_key, title_key
+from isbn_resolver import BULK_BATCH, resolve_bulk
+from lookup import ISBN_OVERRIDE, TITLE_OVERRIDE, find_isbn, get_cover_url, guess_author_from_keywords
+from openbd import prefetch_openbd
+from query_plans import get_query_planner
+
+
+def enrich_one(title: str, isbn: str, keywords: str, row_hash: str = "") -> dict:
+    """1冊ぶんの ISBN と表紙を解決して、マニフェストの1エントリを返す。"""
+    author = guess_author_from_keywords(keywords)
+    isbn = isbn or ISBN_OVERRIDE.get(title) or find_isbn(TITLE_OVERRIDE.get(title, title), author) or ""
+    get_cover_url(isbn or None, title, author)
+    store = get_cover_store()
+    hit = store.get(title_key(title))
+    if hit is None and isbn:
+        # 表紙が ISBN のキーにだけある（以前の実行・別の行で保存済み）なら、タイトルのキーも同じ画像に向ける
+        by_isbn = store.get(isbn_key(isbn))
+        if by_isbn is not None:
+            store.link([title_key(title)], by_isbn.digest)
+            hit = store.get(title_key(title))
+    return {
+        "isbn": isbn,
+        "cover_digest": hit.digest if hit else "",
+        "cover_source": hit.source if hit else "",
+        "resolved_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        # シート側の行が変わったら解決し直すための目印
+        "row_hash": row_hash,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="同時に解決する冊数（上流への負荷に注意）")
+    parser.add_argument("--force", action="store_true", help="解決済みの行も、見つからなかった行もやり直す")
+    parser.add_argument("--limit", type=int, default=0, help="先頭から N 行だけ処理する（動作確認用）")
+    parser.add_argument("--bulk-size", type=int, default=BULK_BATCH,
+                        help="ISBN の無い行を何タイトルずつまとめて NDL に問い合わせるか（0 で1冊ずつ）")
+    parser.add_argument("--output", default=None, help="マニフェストの出力先（既定: data/enrichment_manifest.json）")
+    args = parser.parse_args(argv)
+
+    books = load_books()
+    if books.empty:
+        # シートが取れないときに「全タイトルが消えた」とみなしてマニフェストを消さない
+        print("catalogue sheet unavailable; manifest left untouched", file=sys.stderr)
+        return 1
+    entries = load_manifest(args.output)
+    titles = set(books["title"])
+    # シートから消えたタイトルは捨てる
+    entries = {t: e for t, e in entries.items() if t in titles}
+
+    hashes = books.attrs.get("row_hashes", {})
+
+    def needs_work(title: str) -> bool:
+        entry = entries.get(title, {})
+        # 未解決の行と、前回の解決以降にシート側で内容が変わった行だけを処理する
+        return args.force or not entry.get("cover_digest") or entry.get("row_hash") != hashes.get(title, "")
+
+    todo = [
+        (row["title"], row["isbn"], row["keywords"], hashes.get(row["title"], ""))
+        for _, row in books.iterrows()
+        if needs_work(row["title"])
+    ]
+    if args.limit:
+        todo = todo[: args.limit]
+    print(f"{len(books)} titles, {len(todo)} to resolve ({args.workers} workers)")
+
+    started = time.monotonic()
+    if args.force:
+        # 全行やり直すときは「見つからなかった」記録も捨てて、再確認の時期を待たずに引き直す
+        get_cover_store().clear_misses()
+    # ISBN の無い行は、まず OR でまとめた NDL 検索で一括に引く。残りだけを find_isbn で1冊ずつ
+    missing = [title for title, isbn, _, _ in todo if not (isbn or ISBN_OVERRIDE.get(title))]
+    if missing and args.bulk_size > 0:
+        bulk = resolve_bulk([TITLE_OVERRIDE.get(t, t) for t in missing], batch=args.bulk_size)
+        by_query = {TITLE_OVERRIDE.get(t, t): t for t in missing}
+        found = {by_query[q]: isbn for q, isbn in bulk.items()}
+        todo = [(title, isbn or found.get(title, ""), kw, h) for title, isbn, kw, h in todo]
+        print(f"bulk NDL: {len(found)}/{len(missing)} ISBNs in {time.monotonic() - started:.1f}s")
+    # 分かっている ISBN の表紙有無を OpenBD の書誌でまとめて確認しておく（表紙の無い ISBN は画像を取りに行かない）
+    known = [isbn or ISBN_OVERRIDE.get(title, "") for title, isbn, _, _ in todo]
+    covers = prefetch_openbd([i for i in known if i], force=args.force)
+    print(f"OpenBD prefetch: {sum(bool(u) for u in covers.values())}/{len(covers)} ISBNs have covers")
+    n_isbn = n_cover = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(enrich_one, *job): job[0] for job in todo}
+        for fut in as_completed(futures):
+            title = futures[fut]
+            try:
+                entry = fut.result()
+            except Exception as e:
+                print(f"  !! {title}: {e}")
+                continue
+            entries[title] = entry
+            n_isbn += bool(entry["isbn"])
+            n_cover += bool(entry["cover_digest"])
+            print(f"  {'○' if entry['cover_digest'] else '×'} {title} isbn={entry['isbn'] or '-'} {entry['cover_source']}")
+
+    save_manifest(entries, args.output)
+    # 差し替え・破棄でどのキーからも参照されなくなった画像を片付ける
+    pruned = get_cover_store().prune()
+    print(f"pruned {pruned} unreferenced cover images")
+    print(
+        f"done in {time.monotonic() - started:.1f}s: isbn {n_isbn}/{len(todo)}, cover {n_cover}/{len(todo)}; "
+        f"store {get_cover_store().stats()}"
+    )
+    plan_stats = get_query_planner().stats()
+    print(
+        f"NDL plans: {plan_stats['requests']} requests for {plan_stats['resolutions']} searches "
+        f"({plan_stats['requests_per_resolution']:.1f}/search, {plan_stats['skipped']} pruned plans skipped)"
+    )
+    for p in plan_stats["plans"][:5]:
+        print(f"  {p['plan']}: {p['hits']}/{p['tries']} hits, {p['mean_ms']:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
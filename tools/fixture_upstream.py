@@ -0,0 +1,195 @@
+"""記録済みの上流応答（tools/fixtures/）を返す、ネットワーク不要の偽の上流。
+
+シート CSV・NDL SRU・OpenBD・Google Books の応答を、URL のホストとパスで振り分けて返す。
+fixtures の中身は実在しない60冊ぶんの架空の書誌で、本物の応答と同じ形・同じくらいの大きさにしてある
+（ISBN の無い行・NDL だけにある本・表紙の無い本などを混ぜてある）。
+本物の API と同じく、問い合わせの中身に応じて絞り込む（NDL は CQL 中の書名、
+OpenBD /v1/get は要求した ISBN の順、Google Books は intitle の書名）。
+
+ReplayAdapter を http_client.set_transport() に渡すと、アプリ側のコードを変えずに
+すべての上流呼び出しがここに来る。リクエスト数と受信バイト数はホストごとに数える。
+"""
+from __future__ import annotations
+
+import io
+import json
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import HTTPAdapter
+from requests.models import PreparedRequest, Response
+from requests.structures import CaseInsensitiveDict
+
+from cover_store import normalize_title
+from title_index import clean_title
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+_SRW = "http://www.loc.gov/zing/srw/"
+_DC = "http://purl.org/dc/elements/1.1/"
+# CQL 中の書名の指定（title="…" / title any "…"）
+_CQL_TITLE = re.compile(r'title\s*(?:=|any)\s*"([^"]*)"')
+# Google Books の q 中の書名の指定（intitle:"…" / intitle:…）
+_GB_TITLE = re.compile(r'intitle:(?:"([^"]*)"|(\S+))')
+
+ET.register_namespace("", _SRW)
+
+
+class Reply:
+    """偽の上流が返す1件の応答。"""
+
+    def __init__(self, status: int, body: bytes = b"", content_type: str = "text/plain", headers: dict | None = None):
+        self.status = status
+        self.body = body
+        self.headers = {"Content-Type": content_type, **(headers or {})}
+
+
+def _matches(term: str, title: str) -> bool:
+    """CQL の書名指定が記録の書名に当たるか（正規化して部分一致。NDL の any より少し厳しめ）。"""
+    t, r = normalize_title(clean_title(term)), normalize_title(clean_title(title))
+    return bool(t) and bool(r) and (t in r or r in t)
+
+
+class FixtureUpstream:
+    """fixtures ディレクトリの内容から、URL ごとの応答を組み立てる。スレッドセーフ（読み取りのみ）。"""
+
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR):
+        self.dir = fixtures_dir
+        with open(self._path("sheet.csv"), "rb") as f:
+            self.sheet = f.read()
+        self._ndl = ET.parse(self._path("ndl_sru.xml")).getroot()
+        self._ndl_records = [
+            (rec, rec.findtext(f".//{{{_DC}}}title") or "")
+            for rec in self._ndl.iter(f"{{{_SRW}}}record")
+        ]
+        with open(self._path("google_volumes.json"), encoding="utf-8") as f:
+            self._volumes = json.load(f).get("items", [])
+        with open(self._path("openbd_get.json"), encoding="utf-8") as f:
+            self._openbd = {rec["summary"]["isbn"]: rec for rec in json.load(f)}
+        covers_dir = self._path("covers")
+        self._covers = [
+            open(os.path.join(covers_dir, name), "rb").read()
+            for name in sorted(os.listdir(covers_dir)) if name.endswith(".jpg")
+        ]
+        # Google Books の content エンドポイントで表紙を返す ISBN / ボリューム ID
+        self._gb_isbns = {
+            ident["identifier"]
+            for it in self._volumes
+            for ident in it["volumeInfo"].get("industryIdentifiers", [])
+            if ident.get("type") == "ISBN_13"
+        }
+        self._gb_ids = {it["id"] for it in self._volumes}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def _cover(self, key: str) -> Reply:
+        body = self._covers[sum(map(ord, key)) % len(self._covers)]
+        return Reply(200, body, "image/jpeg", {"ETag": f'"{len(body)}-{key}"'})
+
+    def respond(self, method: str, url: str) -> Reply:
+        """method と URL から応答を返す。知らない URL は 404。"""
+        u = urlsplit(url)
+        host, path, q = u.netloc.lower(), u.path, parse_qs(u.query)
+        arg = lambda name: (q.get(name) or [""])[0]  # noqa: E731
+        if host == "docs.google.com":
+            return Reply(200, self.sheet, "text/csv; charset=utf-8")
+        if host == "iss.ndl.go.jp" and path == "/api/sru":
+            return self._ndl_search(arg("query"), int(arg("startRecord") or 1), int(arg("maximumRecords") or 200))
+        if host == "api.openbd.jp" and path == "/v1/get":
+            isbns = [s for s in arg("isbn").split(",") if s]
+            return Reply(200, json.dumps([self._openbd.get(i) for i in isbns], ensure_ascii=False).encode(),
+                         "application/json; charset=utf-8")
+        if host == "api.openbd.jp" and path.startswith("/v1/cover/"):
+            isbn = path.rsplit("/", 1)[-1].removesuffix(".jpg")
+            rec = self._openbd.get(isbn)
+            return self._cover(isbn) if rec and rec["summary"]["cover"] else Reply(404)
+        if host == "cover.openbd.jp":
+            isbn = path.strip("/").removesuffix(".jpg")
+            return self._cover(isbn) if isbn in self._openbd else Reply(404)
+        if host == "www.googleapis.com" and path == "/books/v1/volumes":
+            return self._volumes_search(arg("q"), int(arg("maxResults") or 10))
+        if host == "books.google.com" and path == "/books/content":
+            vid, vol = arg("vid").removeprefix("ISBN"), arg("id")
+            if vid in self._gb_isbns or vol in self._gb_ids:
+                return self._cover(vid or vol)
+            return Reply(404)
+        return Reply(404)
+
+    def _ndl_search(self, cql: str, start: int, maximum: int) -> Reply:
+        terms = _CQL_TITLE.findall(cql)
+        hits = [rec for rec, title in self._ndl_records if any(_matches(t, title) for t in terms)]
+        page = hits[max(start - 1, 0):max(start - 1, 0) + maximum]
+        root = ET.Element(f"{{{_SRW}}}searchRetrieveResponse")
+        ET.SubElement(root, f"{{{_SRW}}}version").text = "1.2"
+        ET.SubElement(root, f"{{{_SRW}}}numberOfRecords").text = str(len(hits))
+        records = ET.SubElement(root, f"{{{_SRW}}}records")
+        records.extend(page)
+        if start - 1 + len(page) < len(hits):
+            ET.SubElement(root, f"{{{_SRW}}}nextRecordPosition").text = str(start + len(page))
+        body = ET.tostring(root, encoding="utf-8", xml_declaration=True)
+        return Reply(200, body, "application/xml; charset=utf-8")
+
+    def _volumes_search(self, q: str, max_results: int) -> Reply:
+        terms = [a or b for a, b in _GB_TITLE.findall(q)] or [q]
+        items = [
+            it for it in self._volumes
+            if any(_matches(t, it["volumeInfo"].get("title", "")) for t in terms)
+        ][:max_results]
+        payload = {"kind": "books#volumes", "totalItems": len(items)}
+        if items:
+            payload["items"] = items
+        return Reply(200, json.dumps(payload, ensure_ascii=False).encode(), "application/json; charset=utf-8")
+
+
+class ReplayAdapter(HTTPAdapter):
+    """requests のトランスポートとして FixtureUpstream の応答を返す。
+
+    latency を渡すと1リクエストごとにその秒数だけ待つ（実際の往復時間の代わり）。
+    """
+
+    def __init__(self, upstream: FixtureUpstream | None = None, latency: float = 0.0):
+        super().__init__()
+        self.upstream = upstream or FixtureUpstream()
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.requests: Counter[str] = Counter()
+        self.bytes: Counter[str] = Counter()
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.bytes.clear()
+
+    def totals(self) -> tuple[int, int]:
+        """(リクエスト数, 受信バイト数) の合計。"""
+        with self._lock:
+            return sum(self.requests.values()), sum(self.bytes.values())
+
+    def send(self, request: PreparedRequest, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.latency:
+            time.sleep(self.latency)
+        reply = self.upstream.respond(request.method, request.url)
+        body = b"" if request.method == "HEAD" else reply.body
+        host = urlsplit(request.url).netloc.lower()
+        with self._lock:
+            self.requests[host] += 1
+            self.bytes[host] += len(body)
+        resp = Response()
+        resp.status_code = reply.status
+        resp.headers = CaseInsensitiveDict(reply.headers)
+        resp.headers["Content-Length"] = str(len(body))
+        resp.raw = io.BytesIO(body)
+        resp.url = request.url
+        resp.request = request
+        resp.reason = "OK" if reply.status == 200 else "Not Found"
+        resp.encoding = "utf-8" if "charset=utf-8" in reply.headers["Content-Type"] else None
+        return resp
+
+    def close(self) -> None:
+        pass
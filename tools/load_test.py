@@ -0,0 +1,227 @@
+"""1プロセスで何人まで同時に捌けるかを測る、ヘッドレスの負荷試験。
+
+Streamlit の AppTest で app.py のセッションを同時にいくつも動かし、各セッションに
+「フォームを開く → テーマ・気持ち・読み方を選ぶ → 『本をえらぶ』を押す」を繰り返させる。
+上流は tools/fixtures/ の記録済み応答で置き換える（--latency で往復時間を足せる）。
+UPSTREAM_BASE_URL を設定して起動すれば、tools/stub_server.py の遅い・落ちる上流にも向けられる。
+
+同時セッション数ごとに、結果ページのスループット・1操作の p50 / p95 / p99・CPU 使用率・
+RSS のピークを出す。レプリカ数の見積もり用。
+
+使い方（リポジトリ直下で）:
+    python -m tools.load_test                          # 1, 2, 4, 8 セッション
+    python -m tools.load_test --sessions 1,4,16 --rounds 5 --latency 0.1
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+# 本番のストア・マニフェスト・統計には触らない
+_WORKDIR = tempfile.mkdtemp(prefix="book-load-")
+os.environ["COVER_STORE_PATH"] = os.path.join(_WORKDIR, "covers.sqlite3")
+os.environ["ENRICHMENT_MANIFEST_PATH"] = os.path.join(_WORKDIR, "manifest.json")
+os.environ["QUERY_PLAN_STATS_PATH"] = os.path.join(_WORKDIR, "query_plans.json")
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import http_client  # noqa: E402
+from metrics import get_metrics  # noqa: E402
+from tools.fixture_upstream import ReplayAdapter  # noqa: E402
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+# 1回のスクリプト実行を待つ上限（秒）。初回はカタログの読み込みを含む
+RUN_TIMEOUT: float = 120.0
+SEARCH_LABEL = "本をえらぶ"
+
+
+@dataclass
+class LevelResult:
+    sessions: int
+    pages: int
+    errors: int
+    seconds: float
+    pages_per_sec: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    cpu_percent: float
+    peak_rss_mb: float
+    rss_per_session_mb: float | None  # /proc が無く今の RSS を測れないときは None
+    upstream_requests: int
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))]
+
+
+# 今の RSS を /proc から読めるか。読めなければプロセス起動以来のピーク（ru_maxrss）で代用するので、
+# 段ごとの増分（MB/sess）は出せない
+RSS_IS_CURRENT: bool = os.path.exists("/proc/self/statm")
+
+
+def _rss_mb() -> float:
+    """今の RSS（MB）。/proc が無い環境ではプロセス起動以来のピーク値で代用する。"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+class RssSampler:
+    """別スレッドで RSS を一定間隔で測り、区間内のピークを覚える。"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> RssSampler:
+        self.peak = _rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_mb())
+
+
+def _upstream_requests() -> int:
+    return int(sum(r["value"] for r in get_metrics().counters() if r["metric"] == "upstream_requests_total"))
+
+
+def _find_search_button(at: AppTest):
+    for b in at.button:
+        if SEARCH_LABEL in b.label:
+            return b
+    raise LookupError(f"「{SEARCH_LABEL}」ボタンが見つかりません")
+
+
+def run_session(seed: int, rounds: int, timings: list[float], lock: threading.Lock) -> tuple[int, int]:
+    """1セッションぶんの操作を流し、(表示できた結果ページ数, 失敗数) を返す。
+
+    timings には「ボタンを押してから結果が出るまで」の1操作ごとの時間（ミリ秒）を足す。
+    """
+    rng = random.Random(seed)
+    at = AppTest.from_file(APP_PATH, default_timeout=RUN_TIMEOUT)
+    at.run()
+    if at.exception:
+        return 0, rounds
+    pages = errors = 0
+    for _ in range(rounds):
+        at.selectbox(key="k_interest").set_value(rng.choice(at.selectbox(key="k_interest").options))
+        at.radio(key="k_feeling").set_value(rng.choice(at.radio(key="k_feeling").options))
+        at.radio(key="k_extra").set_value(rng.choice(at.radio(key="k_extra").options))
+        t0 = time.perf_counter()
+        try:
+            _find_search_button(at).click().run()
+        except Exception:
+            errors += 1
+            continue
+        elapsed = (time.perf_counter() - t0) * 1000
+        if at.exception or at.error:
+            errors += 1
+            continue
+        pages += 1
+        with lock:
+            timings.append(elapsed)
+    return pages, errors
+
+
+def run_level(sessions: int, rounds: int) -> LevelResult:
+    timings: list[float] = []
+    lock = threading.Lock()
+    requests0 = _upstream_requests()
+    cpu0 = resource.getrusage(resource.RUSAGE_SELF)
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    with RssSampler() as sampler, ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [pool.submit(run_session, 1000 * sessions + i, rounds, timings, lock) for i in range(sessions)]
+        outcomes = [f.result() for f in futures]
+    wall = time.perf_counter() - t0
+    cpu1 = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (cpu1.ru_utime - cpu0.ru_utime) + (cpu1.ru_stime - cpu0.ru_stime)
+    pages = sum(p for p, _ in outcomes)
+    return LevelResult(
+        sessions=sessions,
+        pages=pages,
+        errors=sum(e for _, e in outcomes),
+        seconds=wall,
+        pages_per_sec=pages / wall if wall else 0.0,
+        p50_ms=_percentile(timings, 0.50),
+        p95_ms=_percentile(timings, 0.95),
+        p99_ms=_percentile(timings, 0.99),
+        cpu_percent=100 * cpu / wall if wall else 0.0,
+        peak_rss_mb=sampler.peak,
+        rss_per_session_mb=max(0.0, sampler.peak - rss0) / sessions if RSS_IS_CURRENT else None,
+        upstream_requests=_upstream_requests() - requests0,
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", default="1,2,4,8", help="同時セッション数（カンマ区切りで順に測る）")
+    parser.add_argument("--rounds", type=int, default=3, help="1セッションが『本をえらぶ』を押す回数")
+    parser.add_argument("--latency", type=float, default=0.05, help="記録済み上流の1リクエストあたりの待ち時間（秒。代役サーバー使用時は無視）")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出す")
+    args = parser.parse_args(argv)
+
+    # UPSTREAM_BASE_URL が設定されていればその代役サーバーへ、無ければ記録済み応答を直接返す
+    if not http_client.UPSTREAM_BASE_URL:
+        http_client.set_transport(ReplayAdapter(latency=args.latency))
+
+    # カタログの初回読み込みと索引づくりは1セッションで済ませてから測る（レプリカの起動直後は別に考える）
+    t0 = time.perf_counter()
+    _, warm_errors = run_session(0, 1, [], threading.Lock())
+    warmup = time.perf_counter() - t0
+    if warm_errors:
+        print("ウォームアップのセッションが結果ページを出せませんでした", file=sys.stderr)
+        return 1
+
+    results = [run_level(int(n), args.rounds) for n in args.sessions.split(",") if n.strip()]
+    http_client.set_transport(None)
+
+    if args.json:
+        json.dump({"warmup_seconds": warmup, "rounds": args.rounds, "latency": args.latency,
+                   "rss": "current" if RSS_IS_CURRENT else "process_lifetime_peak",
+                   "levels": [asdict(r) for r in results]}, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+        return 0
+    print(f"warm-up (first session, cold catalogue): {warmup:.2f}s")
+    print(f"{'sessions':>8}{'pages':>7}{'err':>5}{'pages/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'cpu %':>8}{'peak MB':>9}{'MB/sess':>9}{'upstream':>10}")
+    for r in results:
+        per_session = "-" if r.rss_per_session_mb is None else f"{r.rss_per_session_mb:.1f}"
+        print(f"{r.sessions:>8}{r.pages:>7}{r.errors:>5}{r.pages_per_sec:>9.2f}{r.p50_ms:>9.0f}{r.p95_ms:>9.0f}"
+              f"{r.p99_ms:>9.0f}{r.cpu_percent:>8.0f}{r.peak_rss_mb:>9.0f}{per_session:>9}"
+              f"{r.upstream_requests:>10}")
+    if not RSS_IS_CURRENT:
+        print("peak MB is the process-lifetime peak (ru_maxrss; /proc unavailable), so MB/sess is not measured")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
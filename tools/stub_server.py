@@ -0,0 +1,169 @@
+"""上流（シート CSV・NDL SRU・OpenBD・Google Books）の代わりをする手元の HTTP サーバー。
+
+tools/fixtures/ の記録済み応答を返す（中身は tools/fixture_upstream.py と同じ）。
+アプリ側は UPSTREAM_BASE_URL をこのサーバーに向けると、https://host/path への呼び出しが
+http://127.0.0.1:8765/host/path に来る。遅延・エラー率・タイムアウト（応答しない）を
+上流ホストごとに設定できるので、ISBN 解決の fanout や再試行が遅い・落ちる上流でどう振る舞うかを見られる。
+
+使い方（リポジトリ直下で）:
+    python -m tools.stub_server --latency 0.2 --latency iss.ndl.go.jp=1.5 --error-rate 0.05
+    UPSTREAM_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+
+--latency / --jitter / --error-rate / --timeout-rate は「値」だけなら全ホスト、
+「ホスト=値」ならそのホストだけに効く（何度でも指定できる）。
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+from tools.fixture_upstream import FixtureUpstream
+
+DEFAULT_PORT: int = 8765
+# タイムアウトを再現するときに黙っている秒数（http_client の読み取りタイムアウトより長く）
+DEFAULT_HANG: float = 30.0
+# エラーを返すときのステータス（http_client が再試行する 5xx / 429 のどれか）
+DEFAULT_ERROR_STATUS: int = 503
+
+
+class HostSetting:
+    """「値」または「ホスト=値」の指定を束ねて、ホストごとの値を返す。"""
+
+    def __init__(self, default: float = 0.0):
+        self.default = default
+        self.hosts: dict[str, float] = {}
+
+    def add(self, spec: str) -> HostSetting:
+        host, sep, value = spec.rpartition("=")
+        if sep:
+            self.hosts[host.lower()] = float(value)
+        else:
+            self.default = float(value)
+        return self
+
+    def get(self, host: str) -> float:
+        return self.hosts.get(host, self.default)
+
+
+class StubConfig:
+    def __init__(self, latency: HostSetting, jitter: HostSetting, error_rate: HostSetting,
+                 timeout_rate: HostSetting, hang: float = DEFAULT_HANG,
+                 error_status: int = DEFAULT_ERROR_STATUS, seed: int | None = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], config: StubConfig, upstream: FixtureUpstream | None = None,
+                 quiet: bool = False):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.upstream = upstream or FixtureUpstream()
+        self.quiet = quiet
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self._serve(head=False)
+
+    def do_HEAD(self) -> None:
+        self._serve(head=True)
+
+    def _serve(self, head: bool) -> None:
+        # /host/path?query → https://host/path?query
+        u = urlsplit(self.path)
+        host, _, rest = u.path.lstrip("/").partition("/")
+        host = host.lower()
+        url = urlunsplit(("https", host, "/" + rest, u.query, ""))
+        cfg = self.server.config
+
+        delay = cfg.latency.get(host) + cfg.jitter.get(host) * cfg.roll()
+        if delay > 0:
+            time.sleep(delay)
+        if cfg.roll() < cfg.timeout_rate.get(host):
+            # 応答せずに黙る（クライアント側の読み取りタイムアウトを起こす）
+            time.sleep(cfg.hang)
+            self.close_connection = True
+            return
+        if cfg.roll() < cfg.error_rate.get(host):
+            self._reply(cfg.error_status, b"stub error\n", {"Content-Type": "text/plain"}, head)
+            return
+        reply = self.server.upstream.respond("HEAD" if head else "GET", url)
+        self._reply(reply.status, reply.body, reply.headers, head)
+
+    def _reply(self, status: int, body: bytes, headers: dict, head: bool) -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", action="append", default=[], metavar="[HOST=]SECONDS",
+                        help="1リクエストごとに足す待ち時間")
+    parser.add_argument("--jitter", action="append", default=[], metavar="[HOST=]SECONDS",
+                        help="待ち時間に足すばらつき（0〜この秒数の一様乱数）")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="[HOST=]RATE",
+                        help="--error-status を返す割合（0〜1）")
+    parser.add_argument("--timeout-rate", action="append", default=[], metavar="[HOST=]RATE",
+                        help="応答せずに --hang 秒黙る割合（0〜1）")
+    parser.add_argument("--hang", type=float, default=DEFAULT_HANG, help="タイムアウトを再現するときに黙る秒数")
+    parser.add_argument("--error-status", type=int, default=DEFAULT_ERROR_STATUS)
+    parser.add_argument("--seed", type=int, default=None, help="エラー・タイムアウトの乱数の種（再現用）")
+    parser.add_argument("--quiet", action="store_true", help="アクセスログを出さない")
+    args = parser.parse_args(argv)
+
+    def setting(specs: list[str]) -> HostSetting:
+        s = HostSetting()
+        for spec in specs:
+            s.add(spec)
+        return s
+
+    config = StubConfig(
+        setting(args.latency), setting(args.jitter), setting(args.error_rate), setting(args.timeout_rate),
+        hang=args.hang, error_status=args.error_status, seed=args.seed,
+    )
+    server = StubServer((args.host, args.port), config, quiet=args.quiet)
+    print(f"stub upstream on http://{args.host}:{server.server_port} "
+          f"(UPSTREAM_BASE_URL=http://{args.host}:{server.server_port})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())